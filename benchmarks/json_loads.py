@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Compare the JSON decoders that can be used as PROD_DETAILS_JSON_LOADS.
+
+Parses every JSON file of a product details directory with the standard
+library and with each of the faster decoders that are installed:
+
+    python benchmarks/json_loads.py [json_dir]
+
+The directory defaults to the data shipped with the app.
+"""
+import os
+import sys
+import timeit
+from importlib import import_module
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from product_details import settings_defaults  # noqa: E402
+
+LOADERS = ["json.loads", "orjson.loads", "ujson.loads", "simplejson.loads"]
+
+
+def read_files(json_dir):
+    contents = []
+    for root, dirs, files in os.walk(json_dir):
+        for fn in files:
+            if fn.endswith(".json"):
+                with open(os.path.join(root, fn), encoding="utf8") as json_fo:
+                    contents.append(json_fo.read())
+
+    return contents
+
+
+def get_loader(path):
+    module_path, name = path.rsplit(".", 1)
+    try:
+        return getattr(import_module(module_path), name)
+    except ImportError:
+        return None
+
+
+def main(json_dir):
+    contents = read_files(json_dir)
+    if not contents:
+        sys.exit("No JSON files in %s" % json_dir)
+
+    size = sum(len(c) for c in contents) / 1024.0 / 1024
+    print("%d files, %.1f MB in %s" % (len(contents), size, json_dir))
+    baseline = None
+    for path in LOADERS:
+        loads = get_loader(path)
+        if loads is None:
+            print("%-18s not installed" % path)
+            continue
+
+        best = min(
+            timeit.repeat(lambda: [loads(c) for c in contents], number=5, repeat=5)
+        ) / 5
+        baseline = baseline or best
+        print("%-18s %7.1f ms  %4.1fx" % (path, best * 1000, baseline / best))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else settings_defaults.PROD_DETAILS_DIR)
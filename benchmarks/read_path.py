@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""
+Time the read path of product details with both storage backends.
+
+Runs offline against a generated data set, with the locmem, filebased and
+database cache backends, and prints the results as JSON:
+
+    python benchmarks/read_path.py [--regions 300] [--output results.json]
+
+Each result has the operation, and the storage, cache and storage options
+it was measured with, and the best mean time per call in microseconds out of
+a few repeats.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+CACHES = {
+    "locmem": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "filebased": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache"},
+    "db": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "product_details_cache",
+    },
+}
+STORAGES = {
+    "fs": "product_details.storage.PDFileStorage",
+    "db": "product_details.storage.PDDatabaseStorage",
+}
+# storage options to measure the cached operations with
+OPTIONS = {
+    "default": {},
+    "per_file": {"cache_per_file": True},
+    "local_cache": {"local_cache_timeout": 60},
+}
+
+
+def generate_data(json_dir, regions, releases):
+    """Write a data set like the real one, with `regions` region files."""
+    rnd = random.Random(0)
+
+    def write(name, data):
+        with open(os.path.join(json_dir, name), "w") as json_fo:
+            json.dump(data, json_fo)
+
+    os.makedirs(os.path.join(json_dir, "regions"))
+    for kind in ("major", "stability", "development"):
+        write(
+            "firefox_history_%s_releases.json" % kind,
+            dict(
+                (
+                    "%d.%d%s" % (i // 10, i % 10, "b1" if kind == "development" else ""),
+                    "20%02d-%02d-%02d" % (i // 100, i % 12 + 1, i % 28 + 1),
+                )
+                for i in range(releases)
+            ),
+        )
+    write("firefox_versions.json", {"LATEST_FIREFOX_VERSION": "100.0"})
+    codes = ["%c%c" % (65 + i // 26, 65 + i % 26) for i in range(250)]
+    locales = ["l%03d" % i for i in range(regions - 2)] + ["de", "en-US"]
+    write(
+        "languages.json",
+        dict((lc, {"English": lc, "native": lc}) for lc in locales),
+    )
+    for locale in locales:
+        write(
+            "regions/%s.json" % locale,
+            dict((code, "%s %08x" % (code, rnd.getrandbits(32))) for code in codes),
+        )
+    for name in ("", "regions"):
+        path = os.path.join(json_dir, name, ".last_update")
+        with open(path, "w") as lm_fo:
+            lm_fo.write("Tue, 01 Mar 2022 00:00:00 GMT")
+
+
+def setup_django(json_dir, cache_dir):
+    caches = dict(CACHES)
+    caches["filebased"] = dict(caches["filebased"], LOCATION=cache_dir)
+    caches["default"] = caches["locmem"]
+    settings.configure(
+        DATABASES={
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+        },
+        CACHES=caches,
+        INSTALLED_APPS=["product_details"],
+        PROD_DETAILS_DIR=json_dir,
+    )
+    django.setup()
+
+    from django.core.management import call_command
+
+    # the initial migration imports the files into the database
+    call_command("migrate", verbosity=0)
+    call_command("createcachetable", verbosity=0)
+
+
+def best_mean(fn, number, setup=None):
+    """Return the best mean time of `fn` per call in microseconds."""
+    results = []
+    for _ in range(3):
+        total = 0
+        for _ in range(number):
+            if setup:
+                setup()
+            total += timeit.timeit(fn, number=1)
+        results.append(total / number)
+
+    return min(results) * 1e6
+
+
+def run(number):
+    from product_details import ProductDetails
+    from django.utils.module_loading import import_string
+
+    results = []
+
+    def add(operation, storage, cache, options, fn, number=number, setup=None):
+        results.append(
+            {
+                "operation": operation,
+                "storage": storage,
+                "cache": cache,
+                "options": options,
+                "number": number,
+                "mean_us": round(best_mean(fn, number, setup), 2),
+            }
+        )
+
+    for storage_name, storage_class in STORAGES.items():
+        sto = import_string(storage_class)(cache_name="locmem")
+        for dirname in ("versions", "regions"):
+            add(
+                "dir_data(%s)" % dirname,
+                storage_name,
+                None,
+                None,
+                lambda: sto.dir_data(dirname),
+                number=max(number // 100, 3),
+            )
+
+        for cache_name in CACHES:
+            for options_name, options in OPTIONS.items():
+                sto = import_string(storage_class)(cache_name=cache_name, **options)
+                pd = ProductDetails(storage_class=storage_class)
+                pd._real_storage = sto
+                sto.clear_cache()
+                args = (storage_name, cache_name, options_name)
+                add(
+                    "data() miss",
+                    *args,
+                    lambda: sto.data("regions/de.json"),
+                    number=max(number // 100, 3),
+                    setup=lambda: sto.delete_cache("regions")
+                )
+                sto.data("regions/de.json")
+                sto.data("firefox_versions.json")
+                add("data() hit", *args, lambda: sto.data("regions/de.json"))
+                add("__getattr__", *args, lambda: pd.firefox_versions)
+                add("get_regions()", *args, lambda: pd.get_regions("de-AT"))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--regions", type=int, default=300, help="region files")
+    parser.add_argument("--releases", type=int, default=1000, help="releases")
+    parser.add_argument("--number", type=int, default=100, help="calls per run")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        json_dir = os.path.join(tmp_dir, "json")
+        generate_data(json_dir, args.regions, args.releases)
+        setup_django(json_dir, os.path.join(tmp_dir, "cache"))
+        results = {
+            "python": sys.version.split()[0],
+            "django": django.get_version(),
+            "regions": args.regions,
+            "results": run(args.number),
+        }
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_fo:
+            output_fo.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,10 @@ from collections import defaultdict
 
 from django.utils.module_loading import import_string
 
-from product_details.utils import settings_fallback
+from product_details import signals
+from product_details.releases import HISTORY_FILES, ReleaseIndex
+from product_details.utils import LRUCache, settings_fallback
+from product_details.version_compare import version_list
 
 
 class MissingJSONData(IOError):
@@ -11,7 +14,7 @@ class MissingJSONData(IOError):
 
 
 __version__ = "1.0.3"
-__all__ = ["__version__", "product_details", "version_compare"]
+__all__ = ["__version__", "preload", "product_details", "version_compare"]
 
 log = logging.getLogger("product_details")
 log.setLevel(settings_fallback("LOG_LEVEL"))
@@ -35,6 +38,8 @@ class ProductDetails(object):
         self._cache_name = cache_name
         self._cache_timeout = cache_timeout
         self._real_storage = None
+        self._preloaded = None
+        self._derived = LRUCache(100)
 
     @property
     def _storage(self):
@@ -47,9 +52,28 @@ class ProductDetails(object):
         return self._real_storage
 
     def __getattr__(self, key):
-        data = self._storage.data("{0}.json".format(key))
+        data = self._data("{0}.json".format(key))
         return data or defaultdict(lambda: None)
 
+    def _data(self, name):
+        if self._preloaded is not None:
+            return self._preloaded.get(name)
+
+        return self._storage.data(name)
+
+    def preload(self):
+        """Loads all the data into memory and serves it from there from now on.
+
+        Call this before forking worker processes (e.g. from a WSGI module
+        loaded by ``gunicorn --preload``) so that they share it, and again
+        to pick up the data of an update. The data must not be modified.
+        """
+        preloaded = {}
+        for name in ("versions", "regions"):
+            preloaded.update(self._storage.dir_data(name))
+
+        self._preloaded = preloaded
+
     def delete_cache(self, key):
         """Clears the cache for a specific file.
 
@@ -69,19 +93,151 @@ class ProductDetails(object):
         """Return the last-updated date, if it exists."""
         return self._storage.last_modified_datetime("/")
 
-    def get_regions(self, locale):
-        """Loads regions json file into memory, but only as needed."""
+    def release_index(self, product):
+        """Return the `ReleaseIndex` of a product's release history, e.g.
+        "firefox".
+
+        It is only rebuilt when the history files changed.
+        """
+        names = [fn.format(product) + ".json" for fn in HISTORY_FILES]
+        if self._preloaded is not None:
+            data = dict((name, self._preloaded.get(name)) for name in names)
+        else:
+            data = self._storage.data_many(names)
+        histories = tuple(data.get(name) or {} for name in names)
+        return self._derive(("release_index", product), ReleaseIndex, histories)
+
+    def _derive(self, key, build, *sources):
+        """Return ``build(*sources)``, reusing the result of the last call
+        with the same `key` as long as the sources are the same or equal."""
+        derived = self._derived.get(key)
+        if derived is None or not all(
+            s is ds or s == ds for s, ds in zip(sources, derived[0])
+        ):
+            derived = (sources, build(*sources))
+            self._derived.set(key, derived)
+
+        return derived[1]
+
+    def version_list(self, name, **kwargs):
+        """Return `version_list()` of the data of a file, e.g.
+        "firefox_history_major_releases".
+
+        The list is only built again when the file changed, or for different
+        arguments. Pass the same `key` and `filter` functions every time.
+        """
+        data = self._data("{0}.json".format(name)) or {}
+        cache_key = ("version_list", name) + tuple(sorted(kwargs.items()))
+        return list(
+            self._derive(cache_key, lambda d: version_list(d, **kwargs), data)
+        )
+
+    def release_date(self, product, version):
+        """Return the release date of a product's version, or None."""
+        return self.release_index(product).release_date(version)
+
+    def releases_between(self, product, start, end):
+        """Return the product's versions released from `start` to `end`
+        (inclusive), in release order."""
+        return self.release_index(product).releases_between(start, end)
+
+    def latest_release_before(self, product, date):
+        """Return the product's last version released before `date`."""
+        return self.release_index(product).latest_release_before(date)
+
+    def _region_files(self, locale):
+        """Return the region files to try for a locale, in order."""
         lookup = [locale, "en-US"]
         if "-" in locale:
             fallback, _, _ = locale.partition("-")
             lookup.insert(1, fallback)
-        for lk in lookup:
-            key = "regions/%s.json" % lk
-            data = self._storage.data(key)
+        return ["regions/%s.json" % lk for lk in lookup]
+
+    def _caches_per_file(self):
+        # storages that do not derive from ProductDetailsStorage may not say
+        return getattr(self._storage, "caches_per_file", False)
+
+    def _region_candidates(self, locale):
+        """Return the region files to try for a locale, in order.
+
+        With per-file caching only the files that exist are returned, and
+        locales are resolved once per list of region files, misses included.
+        Otherwise all of them are, as they are looked up in a single dict.
+        """
+        if self._preloaded is not None or not self._caches_per_file():
+            return self._region_files(locale)
+
+        names, resolved = self._derive(
+            ("regions",),
+            lambda names: (set(names), LRUCache(1000)),
+            self._storage.file_names("regions"),
+        )
+        candidates = resolved.get(locale)
+        if candidates is None:
+            candidates = [fn for fn in self._region_files(locale) if fn in names]
+            resolved.set(locale, candidates)
+
+        return candidates
+
+    def get_regions(self, locale):
+        """Loads regions json file into memory, but only as needed."""
+        candidates = self._region_candidates(locale)
+        if self._preloaded is None and not self._caches_per_file():
+            # a single fetch of the regions directory for all candidates
+            get_data = self._storage.data_many(candidates).get
+        else:
+            get_data = self._data
+
+        for key in candidates:
+            data = get_data(key)
             if data:
+                self._send_regions_lookup(locale, key)
                 return data
 
+        self._send_regions_lookup(locale, None)
         raise MissingJSONData("Unable to load region data for %s or en-US" % locale)
 
+    def _send_regions_lookup(self, locale, region_file):
+        if signals.regions_lookup.has_listeners(self.__class__):
+            depth = None
+            if region_file:
+                depth = self._region_files(locale).index(region_file)
+            signals.regions_lookup.send(
+                sender=self.__class__, locale=locale, depth=depth
+            )
+
+    def get_regions_many(self, locales):
+        """Returns a dict of the region data of each of the locales."""
+        if self._preloaded is not None:
+            return dict((locale, self.get_regions(locale)) for locale in locales)
+
+        # fetch the first candidate of every locale at once, and the next
+        # ones only for the locales whose file turned out to be empty
+        remaining = dict((locale, self._region_candidates(locale)) for locale in locales)
+        regions = {}
+        while remaining:
+            names = set(fns[0] for fns in remaining.values() if fns)
+            data = self._storage.data_many(names) if names else {}
+            for locale, fns in list(remaining.items()):
+                if fns and data.get(fns[0]):
+                    self._send_regions_lookup(locale, fns[0])
+                    regions[locale] = data[fns[0]]
+                    del remaining[locale]
+                elif len(fns) > 1:
+                    remaining[locale] = fns[1:]
+                else:
+                    self._send_regions_lookup(locale, None)
+                    raise MissingJSONData(
+                        "Unable to load region data for %s or en-US" % locale
+                    )
+
+        return regions
+
 
 product_details = ProductDetails()
+
+
+def preload():
+    """Loads all the data of `product_details` into memory, see
+    :meth:`ProductDetails.preload`."""
+    product_details.preload()
@@ -1,5 +1,5 @@
 import logging
-import re
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 
 import requests
@@ -8,7 +8,21 @@ from django.db import transaction
 from django.utils.module_loading import import_string
 
 
+from product_details.sync import (
+    CHUNK_SIZE,
+    Download,
+    directory_not_modified,
+    get_source,
+    parse_file_list,
+    parse_json,
+    read_body,
+    request_headers,
+    store_files,
+    too_large,
+    update_from_source,
+)
 from product_details.utils import settings_fallback
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
 log = logging.getLogger("prod_details")
@@ -25,8 +39,10 @@ class Command(BaseCommand):
         # some settings
         self.PROD_DETAILS_DIR = settings_fallback("PROD_DETAILS_DIR")
         self.PROD_DETAILS_URL = settings_fallback("PROD_DETAILS_URL")
+        self.max_file_size = settings_fallback("PROD_DETAILS_MAX_FILE_SIZE")
         self._storage = STORAGE_CLASS(json_dir=self.PROD_DETAILS_DIR)
         self.is_db_storage = self._storage.storage_type == "db"
+        self.session = requests.Session()
 
         super(Command, self).__init__(*args, **kwargs)
 
@@ -59,6 +75,26 @@ class Command(BaseCommand):
                 'Defaults to "default".'
             ),
         ),
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of files to download at the same time. Defaults to 1.",
+        ),
+        parser.add_argument(
+            "--source",
+            help=(
+                "Import the files from this URL, local directory, file:// URL "
+                "or tar/zip archive instead of PROD_DETAILS_URL."
+            ),
+        ),
+        parser.add_argument(
+            "--warm-cache",
+            action="store_true",
+            dest="warm_cache",
+            default=False,
+            help="Load the updated data into the cache when done.",
+        ),
 
     def handle(self, *args, **options):
         self.options = options
@@ -71,18 +107,52 @@ class Command(BaseCommand):
         if options["force"]:
             log.info("Product details update forced.")
 
-        if self.is_db_storage:
-            with transaction.atomic(using=options["database"]):
-                self.download_directory()
+        source = options["source"] or self.PROD_DETAILS_URL
+        if source.startswith(("http://", "https://")):
+            self.PROD_DETAILS_URL = source
+            self.download()
+        else:
+            self.import_files(source)
+
+        if options["warm_cache"]:
+            log.debug("Loading the updated data into the cache.")
+            self._storage.warm_cache("versions")
+            self._storage.warm_cache("regions")
+
+        log.debug("Product Details update run complete.")
+
+    def download(self):
+        # Reuse connections across files, one per worker.
+        self.workers = max(self.options["workers"], 1)
+        adapter = HTTPAdapter(pool_maxsize=max(self.workers, 10))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
-            with transaction.atomic(using=options["database"]):
+        try:
+            if self.is_db_storage:
+                with transaction.atomic(using=self.options["database"]):
+                    self.download_directory()
+
+                with transaction.atomic(using=self.options["database"]):
+                    self.download_directory("regions/")
+
+            else:
+                self.download_directory()
                 self.download_directory("regions/")
+        finally:
+            self.session.close()
 
-        else:
-            self.download_directory()
-            self.download_directory("regions/")
+    def import_files(self, location):
+        """Import the files from a local directory or archive."""
+        try:
+            source = get_source(location)
+        except ValueError as e:
+            raise CommandError(str(e))
 
-        log.debug("Product Details update run complete.")
+        log.debug("Importing the JSON files from %s" % location)
+        update_from_source(
+            self._storage, source, self.options["force"], self.options["database"]
+        )
 
     def download_directory(self, dir=""):
         # Grab list of JSON files from server.
@@ -94,33 +164,36 @@ class Command(BaseCommand):
             return
 
         # Grab all modified JSON files from server and replace them locally.
-        had_errors = False
-        for json_file in json_files:
-            if not self.download_json_file(urljoin(dir, json_file)):
-                had_errors = True
-
-        if had_errors:
-            log.warn('Update run had errors, not storing "last updated" timestamp.')
-        else:
-            # Save Last-Modified timestamp to detect updates against next time.
-            log.debug("Writing last-updated timestamp (%s)." % (self.last_mod_response))
-            self._storage.update(dir or "/", "", self.last_mod_response)
+        # Only the downloads run in worker threads, the storage is only
+        # accessed from this thread (e.g. to stay in the DB transaction).
+        json_files = [urljoin(dir, json_file) for json_file in sorted(json_files)]
+        headers = request_headers(self._storage, json_files, self.options["force"])
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.fetch_json_file, json_files, headers))
+
+        store_files(
+            self._storage, dir, self.last_mod_response, zip(json_files, results)
+        )
 
     def get_file_list(self, dir):
         """
         Get list of files to be updated from the server.
         """
         src = urljoin(self.PROD_DETAILS_URL, dir)
+        headers = request_headers(self._storage, [dir or "/"], self.options["force"])
         try:
-            resp = requests.get(src)
+            resp = self.session.get(src, headers=headers[0])
         except RequestException as e:
             raise CommandError("Could not retrieve file list: %s" % e)
 
         # Remember Last-Modified header.
         self.last_mod_response = resp.headers.get("Last-Modified")
 
-        json_files = set(re.findall(r'href="([^"]+.json)"', resp.text))
-        return json_files
+        if directory_not_modified(resp.status_code, self.last_mod_response, headers[0]):
+            log.debug("%s was not modified." % src)
+            return set()
+
+        return parse_file_list(resp.text)
 
     def download_json_file(self, json_file):
         """
@@ -129,42 +202,60 @@ class Command(BaseCommand):
 
         Returns True on success, False otherwise.
         """
-        log.info("Updating %s from server" % json_file)
+        headers = request_headers(self._storage, [json_file], self.options["force"])
+        download = self.fetch_json_file(json_file, headers[0])
+        if download.content is not None:
+            log.debug("Writing new copy of %s." % json_file)
+            self._storage.update(
+                json_file,
+                download.content,
+                download.last_modified,
+                download.etag,
+                data=download.data,
+            )
 
-        if not self.options["force"]:
-            headers = {"If-Modified-Since": self._storage.last_modified(json_file)}
-        else:
-            headers = {}
+        return download.success
+
+    def fetch_json_file(self, json_file, headers):
+        """
+        Downloads a JSON file off the server and checks its validity.
+
+        The response is streamed and the download is aborted once it exceeds
+        PROD_DETAILS_MAX_FILE_SIZE bytes. Returns a
+        `product_details.sync.Download`.
+        """
+        log.info("Updating %s from server" % json_file)
 
         # Grab JSON data if modified
         try:
             url = urljoin(self.PROD_DETAILS_URL, json_file)
-            resp = requests.get(url, headers=headers)
+            with self.session.get(url, headers=headers, stream=True) as resp:
+                if resp.status_code == requests.codes.not_modified:
+                    log.debug("%s was not modified." % json_file)
+                    return Download(True)
+
+                content_length = resp.headers.get("Content-Length")
+                if too_large(json_file, content_length, self.max_file_size):
+                    return Download(False)
+
+                text = read_body(
+                    json_file, resp.iter_content(CHUNK_SIZE), self.max_file_size
+                )
         except RequestException as e:
             log.warn("Error retrieving %s: %s" % (json_file, e))
-            return False
+            return Download(False)
 
-        if resp.status_code == requests.codes.not_modified:
-            log.debug("%s was not modified." % json_file)
-            return True
+        if text is None:
+            return Download(False)
 
-        # Empty results are fishy
-        if not resp.text:
-            log.warn(
-                "JSON source for %s was empty. Cowardly denying to "
-                "import empty data." % json_file
-            )
-            return False
-
-        # Try parsing the file, import if it's valid JSON.
-        try:
-            resp.json()
-        except ValueError:
-            log.warn("Could not parse JSON data from %s. Skipping." % json_file)
-            return False
+        valid, data = parse_json(json_file, text)
+        if not valid:
+            return Download(False)
 
-        # Write JSON data to HD.
-        log.debug("Writing new copy of %s." % json_file)
-        self._storage.update(json_file, resp.text, resp.headers.get("Last-Modified"))
-
-        return True
+        return Download(
+            True,
+            text,
+            resp.headers.get("Last-Modified"),
+            resp.headers.get("ETag"),
+            data,
+        )
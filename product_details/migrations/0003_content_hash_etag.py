@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("product_details", "0002_auto_20151006_1348"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productdetailsfile",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, help_text="SHA-256 digest of the content", max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="productdetailsfile",
+            name="etag",
+            field=models.CharField(
+                blank=True, help_text="Value of ETag HTTP header", max_length=250
+            ),
+        ),
+    ]
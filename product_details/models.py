@@ -7,6 +7,12 @@ class ProductDetailsFile(models.Model):
     last_modified = models.CharField(
         max_length=50, help_text="Value of Last-Modified HTTP header"
     )
+    content_hash = models.CharField(
+        max_length=64, blank=True, help_text="SHA-256 digest of the content"
+    )
+    etag = models.CharField(
+        max_length=250, blank=True, help_text="Value of ETag HTTP header"
+    )
 
     class Meta:
         app_label = "product_details"
@@ -0,0 +1,67 @@
+"""Indexed lookups over the release history of a product."""
+from bisect import bisect_left, bisect_right
+
+from product_details.version_compare import version_int
+
+HISTORY_FILES = (
+    "{0}_history_major_releases",
+    "{0}_history_stability_releases",
+    "{0}_history_development_releases",
+)
+
+
+def date_str(date):
+    """Return `date` as a YYYY-MM-DD string like the release dates."""
+    if hasattr(date, "strftime"):
+        return date.strftime("%Y-%m-%d")
+
+    return date
+
+
+class ReleaseIndex(object):
+    """
+    The releases of a product sorted by version and by date, so they can be
+    searched with bisect.
+
+    ``histories`` are dicts like the ``*_history_*_releases`` files:
+        {'1.0': '2004-11-09'}
+    """
+
+    def __init__(self, histories):
+        releases = {}
+        for history in histories:
+            releases.update(history)
+
+        by_version = sorted((version_int(v), v, d) for v, d in releases.items())
+        self._version_ints = [r[0] for r in by_version]
+        self._version_dates = [r[2] for r in by_version]
+
+        by_date = sorted((d, vi, v) for vi, v, d in by_version)
+        self._dates = [r[0] for r in by_date]
+        self._versions = [r[2] for r in by_date]
+
+    def __len__(self):
+        return len(self._versions)
+
+    def release_date(self, version):
+        """Return the release date of `version`, or None if unknown."""
+        vi = version_int(version)
+        i = bisect_left(self._version_ints, vi)
+        if i < len(self._version_ints) and self._version_ints[i] == vi:
+            return self._version_dates[i]
+
+        return None
+
+    def releases_between(self, start, end):
+        """Return the versions released from `start` to `end`, by date."""
+        lo = bisect_left(self._dates, date_str(start))
+        hi = bisect_right(self._dates, date_str(end))
+        return self._versions[lo:hi]
+
+    def latest_release_before(self, date):
+        """Return the last version released before `date`, or None."""
+        i = bisect_left(self._dates, date_str(date))
+        if i:
+            return self._versions[i - 1]
+
+        return None
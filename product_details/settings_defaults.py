@@ -20,3 +20,35 @@ PROD_DETAILS_CACHE_TIMEOUT = 60 * 60 * 12  # 12 hours
 
 # data storage class
 PROD_DETAILS_STORAGE = "product_details.storage.PDFileStorage"
+
+# largest JSON file (in bytes) to accept from the server. 0 disables the limit.
+PROD_DETAILS_MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
+
+# function to parse JSON with
+PROD_DETAILS_JSON_LOADS = "json.loads"
+
+# how long (in seconds) each process may reuse data it already fetched from the
+# cache before checking that it is still current. 0 disables the local cache.
+PROD_DETAILS_LOCAL_CACHE_TIMEOUT = 0
+
+# maximum number of cache entries each process keeps locally
+PROD_DETAILS_LOCAL_CACHE_SIZE = 100
+
+# cache every file in its own entry instead of one entry per directory
+PROD_DETAILS_CACHE_PER_FILE = False
+
+# on a cache miss only load the requested file instead of its whole
+# directory. Implies PROD_DETAILS_CACHE_PER_FILE.
+PROD_DETAILS_LAZY_LOAD = False
+
+# how long (in seconds) other processes wait for the one filling the cache
+# before filling it themselves. 0 disables locking across processes.
+PROD_DETAILS_CACHE_LOCK_TIMEOUT = 0
+
+# keep the parsed data of each directory of PDFileStorage in a single file
+# that is loaded instead of every JSON file while it is up to date
+PROD_DETAILS_DIR_SNAPSHOT = True
+
+# how often (in seconds) PDFileStorage checks whether the JSON files were
+# updated by another process, to clear their cache. 0 disables the check.
+PROD_DETAILS_RELOAD_INTERVAL = 0
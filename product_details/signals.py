@@ -0,0 +1,26 @@
+"""
+Signals sent while product details are read, e.g. to feed them to statsd.
+
+All of them are sent by storage classes with the storage instance as the
+``storage`` argument, except ``regions_lookup``.
+"""
+from django.dispatch import Signal
+
+# A requested entry was found in the cache.
+# Arguments: storage, key
+cache_hit = Signal()
+
+# A requested entry was not found in the cache and has to be loaded.
+# Arguments: storage, key
+cache_miss = Signal()
+
+# Files were loaded from the storage into the cache.
+# Arguments: storage, name (of the folder, or of the file in lazy mode),
+# duration (in seconds), files (the number of files loaded)
+data_loaded = Signal()
+
+# The region data of a locale was requested from `ProductDetails`.
+# Sent by the ProductDetails class.
+# Arguments: locale, depth (0 for the locale, 1 for its language, 2 for
+# en-US, None if none of them was found)
+regions_lookup = Signal()
@@ -1,38 +1,123 @@
 import codecs
-import json
+import hashlib
 import logging
+import marshal
 import os
 import os.path
 import shutil
 import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
 from datetime import datetime
 
-from product_details import settings_defaults
-from product_details.utils import get_django_cache, settings_fallback
+from django.db import transaction
+
+from product_details import settings_defaults, signals
+from product_details.utils import (
+    LRUCache,
+    get_django_cache,
+    json_loads,
+    settings_fallback,
+)
 
 log = logging.getLogger("product_details")
 
 
+def content_digest(content):
+    """Return the digest used to detect changes of a file's content."""
+    return hashlib.sha256(content.encode("utf8")).hexdigest()
+
+
+def update_fields(update):
+    """
+    Return the (name, content, last_modified, etag, data) fields of an item
+    passed to ``update_many()``, whose parsed data is optional.
+    """
+    return tuple(update) + (None,) * (5 - len(update))
+
+
 class ProductDetailsStorage(object):
     storage_type = None
     _cache_key = "prod-details:{0}"
 
-    def __init__(self, cache_name=None, cache_timeout=None, **kwargs):
+    def __init__(
+        self,
+        cache_name=None,
+        cache_timeout=None,
+        local_cache_timeout=None,
+        local_cache_size=None,
+        cache_per_file=None,
+        lock_timeout=None,
+        lazy_load=None,
+        **kwargs
+    ):
         self._cache_timeout = cache_timeout or settings_fallback(
             "PROD_DETAILS_CACHE_TIMEOUT"
         )
         cache_name = cache_name or settings_fallback("PROD_DETAILS_CACHE_NAME")
         self._cache = get_django_cache(cache_name)
+        if cache_per_file is None:
+            cache_per_file = settings_fallback("PROD_DETAILS_CACHE_PER_FILE")
+        if lazy_load is None:
+            lazy_load = settings_fallback("PROD_DETAILS_LAZY_LOAD")
+        self._lazy_load = lazy_load
+        self._cache_per_file = cache_per_file or lazy_load
+        if lock_timeout is None:
+            lock_timeout = settings_fallback("PROD_DETAILS_CACHE_LOCK_TIMEOUT")
+        self._lock_timeout = lock_timeout
+        self._locks = {}
+
+        if local_cache_timeout is None:
+            local_cache_timeout = settings_fallback("PROD_DETAILS_LOCAL_CACHE_TIMEOUT")
+        self._local_cache_timeout = local_cache_timeout
+        self._local_cache = None
+        if local_cache_timeout:
+            self._local_cache = LRUCache(
+                local_cache_size or settings_fallback("PROD_DETAILS_LOCAL_CACHE_SIZE")
+            )
+
+    @property
+    def caches_per_file(self):
+        """Whether every file is cached in its own entry."""
+        return self._cache_per_file
 
     def _get_cache_key(self, name):
         return self._cache_key.format(name)
 
+    def _get_generation_key(self, name):
+        return self._get_cache_key(name + ":generation")
+
+    def _dir_name(self, name):
+        """Return the name of the directory `name` is cached in."""
+        # will be "regions" or "versions"
+        return os.path.dirname(name) or "versions"
+
+    def _get_index_key(self, name):
+        return self._get_cache_key(name + ":files")
+
     def delete_cache(self, name):
         """Clears the cache for a specific file.
 
         :param name: str file name.
         """
-        self._cache.delete(self._get_cache_key(name))
+        cache_key = self._get_cache_key(name)
+        keys = [cache_key, self._get_generation_key(name)]
+        if self._cache_per_file:
+            index_key = self._get_index_key(name)
+            keys.append(index_key)
+            file_names = self._cache.get(index_key)
+            if file_names is None or self._lazy_load:
+                # files may have been cached without the index, or the index
+                # may have been evicted before them
+                file_names = set(file_names or []).union(self.dir_file_names(name))
+            keys.extend(self._get_cache_key(fn) for fn in sorted(file_names))
+
+        self._cache.delete_many(keys)
+        if self._local_cache is not None:
+            for key in keys:
+                self._local_cache.delete(key)
 
     def clear_cache(self):
         """Clears the entire cache.
@@ -40,6 +125,142 @@ class ProductDetailsStorage(object):
         WARNING: Only use this if you have a separate cache for product-details.
         """
         self._cache.clear()
+        if self._local_cache is not None:
+            self._local_cache.clear()
+
+    def _cache_get_many(self, keys, dirname):
+        """
+        Return a dict of the values found in the cache for `keys`.
+
+        When the local cache is enabled a value fetched before is reused for
+        `local_cache_timeout` seconds. After that it is reused for another
+        period as long as the generation of `dirname` in the cache has not
+        changed, so only a tiny key has to be fetched. Values from the local
+        cache are shared by all callers and must not be modified.
+        """
+        if self._local_cache is None:
+            return self._cache.get_many(keys)
+
+        now = time.time()
+        values = {}
+        stale = {}
+        missing = []
+        for key in keys:
+            entry = self._local_cache.get(key)
+            if entry is None:
+                missing.append(key)
+            elif now - entry[1] < self._local_cache_timeout:
+                values[key] = entry[2]
+            else:
+                stale[key] = entry
+
+        if not (stale or missing):
+            return values
+
+        generation_key = self._get_generation_key(dirname)
+        fetched = self._cache.get_many(missing + [generation_key])
+        generation = fetched.pop(generation_key, None)
+        refetch = []
+        for key, (old_generation, _, value) in stale.items():
+            if generation is not None and old_generation == generation:
+                values[key] = value
+                self._local_cache.set(key, (generation, now, value))
+            else:
+                refetch.append(key)
+
+        if refetch:
+            fetched.update(self._cache.get_many(refetch))
+
+        # out of date local entries are kept to be served while the cache is
+        # being filled by someone else, see `_fill_cache()`.
+        for key in missing + refetch:
+            if key in fetched:
+                values[key] = fetched[key]
+                if generation is not None:
+                    self._local_cache.set(key, (generation, now, fetched[key]))
+
+        return values
+
+    def _stale(self, cache_key):
+        """Return the out of date local copy of `cache_key`, if there is one."""
+        if self._local_cache is not None:
+            entry = self._local_cache.get(cache_key)
+            if entry is not None:
+                return entry[2]
+
+        return None
+
+    def _fill_cache(self, name, read, stale=None, load=None):
+        """
+        Fill the cache for the requested folder name with `warm_cache()` and
+        return its data, making sure only one caller does so at a time. A
+        single file is loaded with `load` instead, if given.
+
+        `read` is called to return the data from the cache (or None) once the
+        lock for the folder is acquired, as another thread may have filled the
+        cache in the meantime. With a `lock_timeout`, other processes are
+        locked out via the cache too. While the lock is held by someone else,
+        `stale` data is returned if given, else the cache is polled until it
+        is filled or the lock times out.
+        """
+        lock = self._locks.setdefault(name, threading.Lock())
+        if not lock.acquire(stale is None):
+            return stale
+
+        try:
+            data = read()
+            if data is not None:
+                return data
+
+            lock_key = self._get_cache_key(name + ":lock")
+            locked_out = bool(self._lock_timeout) and not self._cache.add(
+                lock_key, os.getpid(), self._lock_timeout
+            )
+            if locked_out:
+                if stale is not None:
+                    return stale
+
+                deadline = time.time() + self._lock_timeout
+                while time.time() < deadline:
+                    time.sleep(0.05)
+                    data = read()
+                    if data is not None:
+                        return data
+
+            try:
+                return (load or self.warm_cache)(name)
+            finally:
+                if self._lock_timeout and not locked_out:
+                    self._cache.delete(lock_key)
+        finally:
+            lock.release()
+
+    def _cache_set_many(self, values, dirname):
+        """Store `values` in the cache and start a new generation of `dirname`."""
+        generation = uuid.uuid4().hex
+        to_cache = dict(values)
+        to_cache[self._get_generation_key(dirname)] = generation
+        self._cache.set_many(to_cache, self._cache_timeout)
+        if self._local_cache is not None:
+            now = time.time()
+            for key, value in values.items():
+                self._local_cache.set(key, (generation, now, value))
+
+    def _cache_add_many(self, values, dirname):
+        """
+        Store `values` in the cache in the current generation of `dirname`,
+        so the other entries of the directory stay valid. A new generation is
+        only started if there is none.
+        """
+        generation = self._cache.get(self._get_generation_key(dirname))
+        if generation is None:
+            return self._cache_set_many(values, dirname)
+
+        self._cache.set_many(values, self._cache_timeout)
+        if self._local_cache is not None:
+            now = time.time()
+            for key, value in values.items():
+                self._local_cache.set(key, (generation, now, value))
 
     def last_modified(self, name):
         """
@@ -47,6 +268,36 @@ class ProductDetailsStorage(object):
         """
         raise NotImplementedError()
 
+    def last_modified_many(self, names):
+        """
+        Return a dict of the last-modified values for the requested file names.
+        """
+        return dict((name, self.last_modified(name)) for name in names)
+
+    def etag(self, name):
+        """
+        Return the ETag value for the requested file name, if it is stored.
+        """
+        return None
+
+    def etag_many(self, names):
+        """
+        Return a dict of the ETag values for the requested file names.
+        """
+        return dict((name, self.etag(name)) for name in names)
+
+    def file_meta_many(self, names):
+        """
+        Return a dict of the (last-modified, ETag) values of the requested
+        file names. Directories (e.g. "/" or "regions/") have no ETag.
+        """
+        names = list(names)
+        last_modified = self.last_modified_many(names)
+        etags = self.etag_many([name for name in names if not name.endswith("/")])
+        return dict(
+            (name, (last_modified.get(name), etags.get(name))) for name in names
+        )
+
     def last_modified_datetime(self, name):
         fmt = "%a, %d %b %Y %H:%M:%S %Z"
         try:
@@ -71,27 +322,276 @@ class ProductDetailsStorage(object):
         """
         raise NotImplementedError()
 
+    def dir_file_names(self, name):
+        """
+        Return the sorted list of the file names of the requested folder name,
+        without loading the files if possible.
+        """
+        return sorted(self.dir_data(name))
+
+    def file_data(self, name):
+        """
+        Return the parsed JSON data of the requested file name, loading only
+        that file if possible.
+        """
+        return self.dir_data(self._dir_name(name)).get(name)
+
     def data(self, name):
         """
         Return the parsed JSON data of the requested file name.
         """
-        # will be "regions" or "versions"
-        dirname = os.path.dirname(name) or "versions"
+        self.check_for_updates()
+        dirname = self._dir_name(name)
+        if self._cache_per_file:
+            return self._file_data_per_file(name, dirname)
+
+        return self._cached_dir_data(dirname).get(name)
+
+    def data_many(self, names):
+        """
+        Return a dict of the parsed JSON data of the requested file names.
+
+        The cache is asked once per directory instead of once per file.
+        """
+        self.check_for_updates()
+        by_dir = defaultdict(list)
+        for name in names:
+            by_dir[self._dir_name(name)].append(name)
+
+        data = {}
+        for dirname, dir_names in by_dir.items():
+            if self._cache_per_file:
+                keys = dict((self._get_cache_key(fn), fn) for fn in dir_names)
+                values = self._cache_get_many(list(keys), dirname)
+                for key, fn in keys.items():
+                    if key in values:
+                        self._send_lookup(key, True)
+                        data[fn] = values[key]
+                    else:
+                        data[fn] = self.data(fn)
+            else:
+                dir_data = self._cached_dir_data(dirname)
+                for fn in dir_names:
+                    data[fn] = dir_data.get(fn)
+
+        return data
+
+    def file_names(self, name):
+        """
+        Return the sorted list of the file names of the requested folder name.
+        """
+        self.check_for_updates()
+        if not self._cache_per_file:
+            return sorted(self._cached_dir_data(name))
+
+        index_key = self._get_index_key(name)
+
+        def read():
+            return self._cache_get_many([index_key], name).get(index_key)
+
+        names = read()
+        if names is None and self._lazy_load:
+            names = self.dir_file_names(name)
+            self._cache_add_many({index_key: names}, name)
+        elif names is None:
+            names = sorted(self._fill_cache(name, read, self._stale(index_key)))
+
+        return names
+
+    def _cached_dir_data(self, dirname):
+        """Return the parsed JSON data of a folder cached in a single entry."""
         cache_key = self._get_cache_key(dirname)
-        data = self._cache.get(cache_key)
+
+        def read():
+            return self._cache_get_many([cache_key], dirname).get(cache_key)
+
+        data = read()
+        self._send_lookup(cache_key, data is not None)
         if data is None:
-            data = self.dir_data(dirname)
-            if data:
-                self._cache.set(cache_key, data, self._cache_timeout)
+            data = self._fill_cache(dirname, read, self._stale(cache_key))
+
+        return data
+
+    def _send_lookup(self, key, hit):
+        signal = signals.cache_hit if hit else signals.cache_miss
+        signal.send(sender=self.__class__, storage=self, key=key)
+
+    def _file_data_per_file(self, name, dirname):
+        """
+        Return the parsed JSON data of the requested file name, caching every
+        file of the directory in its own entry.
+
+        The list of file names in the directory is cached as well, so that
+        asking for a file that does not exist does not reload the directory.
+        """
+        cache_key = self._get_cache_key(name)
+        index_key = self._get_index_key(dirname)
+
+        def read():
+            values = self._cache_get_many([cache_key, index_key], dirname)
+            if cache_key in values:
+                return {name: values[cache_key]}
+
+            if name not in values.get(index_key, [name]):
+                return {}
+
+            return None
+
+        data = read()
+        self._send_lookup(cache_key, data is not None)
+        if data is None and self._lazy_load:
+            return self._load_file(name, dirname)
+
+        if data is None:
+            stale = self._stale(cache_key)
+            data = self._fill_cache(dirname, read, stale and {name: stale})
 
         return data.get(name)
 
-    def update(self, name, content, last_modified):
+    def _load_file(self, name, dirname):
+        """
+        Load only the requested file name into the cache and return its data,
+        making sure only one caller does so at a time like `_fill_cache()`.
+        """
+        if name not in self.file_names(dirname):
+            return None
+
+        cache_key = self._get_cache_key(name)
+
+        def read():
+            return self._cache_get_many([cache_key], dirname).get(cache_key)
+
+        return self._fill_cache(name, read, self._stale(cache_key), self._warm_file)
+
+    def _warm_file(self, name):
+        """
+        Load the requested file name into the cache and return its data.
+
+        The other files of the directory are left alone.
+        """
+        start = time.monotonic()
+        data = self.file_data(name)
+        self._send_loaded(name, start, int(data is not None))
+        if data is None:
+            return None
+
+        self._cache_add_many({self._get_cache_key(name): data}, self._dir_name(name))
+        return data
+
+    def check_for_updates(self):
+        """
+        Clear the cache of data that was updated without going through this
+        storage, if the backend can tell.
+        """
+        pass
+
+    def warm_cache(self, name, parsed=None):
+        """
+        Load the data of the requested folder name into the cache, replacing
+        what is cached for it, and return it.
+
+        Files whose data is in the `parsed` dict are not parsed again. All
+        entries of the folder are written with a single ``set_many()``.
+        """
+        start = time.monotonic()
+        data = self._updated_dir_data(name, parsed) if parsed else self.dir_data(name)
+        self._send_loaded(name, start, len(data))
+        if not data:
+            return data
+
+        if self._cache_per_file:
+            values = dict((self._get_cache_key(fn), d) for fn, d in data.items())
+            values[self._get_index_key(name)] = sorted(data)
+        else:
+            values = {self._get_cache_key(name): data}
+
+        self._cache_set_many(values, name)
+        return data
+
+    def _send_loaded(self, name, start, files):
+        signals.data_loaded.send(
+            sender=self.__class__,
+            storage=self,
+            name=name,
+            duration=time.monotonic() - start,
+            files=files,
+        )
+
+    def update(self, name, content, last_modified, etag=None, data=None):
         """
         Update the information for the requested file name.
+
+        `data` is the parsed `content` if the caller has it already, e.g.
+        after validating it, so the backend can use it instead of parsing
+        `content` again.
+
+        Returns True if the content changed. Nothing but the last-modified
+        and ETag values should be written if it did not, and the cache should
+        only be invalidated if it did.
         """
         raise NotImplementedError()
 
+    def update_many(self, files):
+        """
+        Update the information for many files at once.
+
+        :param files: iterable of (name, content, last_modified, etag) or
+            (name, content, last_modified, etag, data) tuples.
+
+        Returns the list of names whose content changed.
+        """
+        changed = []
+        for name, content, last_modified, etag, data in map(update_fields, files):
+            kwargs = {"etag": etag} if etag else {}
+            if data is not None:
+                kwargs["data"] = data
+            if self.update(name, content, last_modified, **kwargs):
+                changed.append(name)
+
+        return changed
+
+    def invalidate_file(self, name, data=None):
+        """
+        Clears the cache after the requested file name was updated.
+
+        With per-file caching and the file's parsed `data`, only its entry is
+        replaced, in a new generation of its directory. Its directory is not
+        loaded either way, so updating file by file stays cheap.
+        """
+        dirname = self._dir_name(name)
+        if data is None or not self._cache_per_file:
+            self.delete_cache(dirname)
+            return
+
+        values = {self._get_cache_key(name): data}
+        index_key = self._get_index_key(dirname)
+        file_names = self._cache.get(index_key)
+        if file_names is not None and name not in file_names:
+            values[index_key] = sorted(file_names + [name])
+        self._cache_set_many(values, dirname)
+
+    def _updated_dir_data(self, name, parsed):
+        """
+        Return the parsed JSON data of the requested folder name after an
+        update, taking the data of the files in the `parsed` dict from there.
+        """
+        return self.dir_data(name)
+
+    def invalidate(self, names, parsed=None):
+        """
+        Clears the cache for the directories of the given file names.
+
+        Directories with files in the `parsed` dict of updated data are
+        loaded into the cache instead, so those files are not parsed again.
+        """
+        parsed = parsed or {}
+        parsed_dirs = set(self._dir_name(name) for name in parsed)
+        for dirname in set(self._dir_name(name) for name in names):
+            if dirname in parsed_dirs:
+                self.warm_cache(dirname, parsed)
+            else:
+                self.delete_cache(dirname)
+
 
 class PDDatabaseStorage(ProductDetailsStorage):
     storage_type = "db"
@@ -120,42 +620,221 @@ class PDDatabaseStorage(ProductDetailsStorage):
         if fo:
             return str(fo.content)
 
-    def dir_data(self, name):
+    def _dir_queryset(self, name):
         qs = self.model_class.objects.filter(name__endswith=".json")
         if name == "versions":
-            qs = qs.exclude(name__contains="/")
-        else:
-            qs = qs.filter(name__startswith=name + "/")
+            return qs.exclude(name__contains="/")
+
+        return qs.filter(name__startswith=name + "/")
 
+    def dir_file_names(self, name):
+        return sorted(self._dir_queryset(name).values_list("name", flat=True))
+
+    def file_data(self, name):
+        content = self.content(name)
+        if content:
+            try:
+                return json_loads(content)
+            except ValueError:
+                pass
+
+        return None
+
+    def dir_data(self, name):
+        return self._updated_dir_data(name, {})
+
+    def _updated_dir_data(self, name, parsed):
         data = {}
-        for fo in qs:
+        for fo in self._dir_queryset(name):
+            if fo.name in parsed:
+                data[fo.name] = parsed[fo.name]
+                continue
+
             try:
-                data[fo.name] = json.loads(str(fo.content))
+                data[fo.name] = json_loads(str(fo.content))
             except ValueError:
                 continue
 
         return data
 
-    def update(self, name, content, last_modified):
+    def etag(self, name):
+        fo = self.file_object(name)
+        if fo:
+            return fo.etag or None
+
+        return None
+
+    def update(self, name, content, last_modified, etag=None, data=None):
+        digest = content_digest(content)
         fo = self.file_object(name)
         if not fo:
+            fo = self.model_class(name=name)
+        elif fo.content_hash == digest and fo.content == content:
+            if (fo.last_modified, fo.etag) != (last_modified, etag or ""):
+                fo.last_modified = last_modified
+                fo.etag = etag or ""
+                fo.save(update_fields=["last_modified", "etag"])
+            return False
+
+        fo.content = content
+        fo.content_hash = digest
+        fo.last_modified = last_modified
+        fo.etag = etag or ""
+        fo.save()
+        if content:
+            self.invalidate_file(name, data)
+            return True
+
+        return False
+
+    def last_modified_many(self, names):
+        return dict(
+            (name, fields[0]) for name, fields in self._file_fields(names).items()
+        )
+
+    def etag_many(self, names):
+        return dict(
+            (name, fields[1] or None)
+            for name, fields in self._file_fields(names).items()
+        )
+
+    def file_meta_many(self, names):
+        return dict(
+            (name, (fields[0], fields[1] or None))
+            for name, fields in self._file_fields(names).items()
+        )
+
+    def _file_fields(self, names, *fields):
+        # a single query for the whole (small) table is cheaper than
+        # a huge IN clause, and it is not limited in size.
+        names = set(names)
+        if not names:
+            return {}
+
+        rows = self.model_class.objects.values_list(
+            "name", "last_modified", "etag", *fields
+        )
+        return dict((row[0], row[1:]) for row in rows if row[0] in names)
+
+    def update_many(self, files):
+        files = [update_fields(f) for f in files]
+        existing = self._file_fields((f[0] for f in files), "content_hash")
+        to_create = []
+        to_update = []
+        to_touch = []
+        for name, content, last_modified, etag, data in files:
             fo = self.model_class(
-                name=name, content=content, last_modified=last_modified
+                name=name,
+                content=content,
+                content_hash=content_digest(content),
+                last_modified=last_modified,
+                etag=etag or "",
             )
-        else:
-            fo.content = content
-            fo.last_modified = last_modified
+            if name not in existing:
+                to_create.append(fo)
+            elif existing[name][2] != fo.content_hash:
+                to_update.append(fo)
+            elif existing[name][:2] != (fo.last_modified, fo.etag):
+                to_touch.append(fo)
 
-        fo.save()
+        if to_create:
+            self.model_class.objects.bulk_create(to_create)
+        if to_update:
+            self.model_class.objects.bulk_update(
+                to_update,
+                ["content", "content_hash", "last_modified", "etag"],
+                batch_size=100,
+            )
+        if to_touch:
+            self.model_class.objects.bulk_update(
+                to_touch, ["last_modified", "etag"], batch_size=100
+            )
+
+        changed = [fo.name for fo in to_create + to_update if fo.content]
+        if changed:
+            parsed = dict((f[0], f[4]) for f in files if f[4] is not None)
+            self.invalidate(changed, parsed)
+
+        return changed
+
+    def invalidate(self, names, parsed=None):
+        # readers must not fill the cache with the old rows before the
+        # transaction the new ones were written in is committed.
+        transaction.on_commit(
+            lambda: super(PDDatabaseStorage, self).invalidate(names, parsed)
+        )
+
+    def invalidate_file(self, name, data=None):
+        transaction.on_commit(
+            lambda: super(PDDatabaseStorage, self).invalidate_file(name, data)
+        )
 
 
 class PDFileStorage(ProductDetailsStorage):
     storage_type = "fs"
     last_modified_dir_file_name = ".last_update"
 
-    def __init__(self, json_dir=None, cache_name=None, cache_timeout=None):
-        super(PDFileStorage, self).__init__(cache_name, cache_timeout)
+    def __init__(
+        self,
+        json_dir=None,
+        cache_name=None,
+        cache_timeout=None,
+        snapshot=None,
+        reload_interval=None,
+        **kwargs
+    ):
+        super(PDFileStorage, self).__init__(cache_name, cache_timeout, **kwargs)
         self.json_dir = json_dir or settings_fallback("PROD_DETAILS_DIR")
+        if snapshot is None:
+            snapshot = settings_fallback("PROD_DETAILS_DIR_SNAPSHOT")
+        self._snapshot = snapshot
+        if reload_interval is None:
+            reload_interval = settings_fallback("PROD_DETAILS_RELOAD_INTERVAL")
+        self._reload_interval = reload_interval
+        self._next_update_check = 0
+        self._update_stamp = None
+
+    def _last_update_stamp(self):
+        """Return the modification times of the last-updated files."""
+        stamp = []
+        for name in ("/", "regions/"):
+            try:
+                stamp.append(os.stat(self.last_modified_file_name(name)).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+
+        return stamp
+
+    def check_for_updates(self):
+        """
+        Clear the cache of both directories when the last-updated files
+        changed, checking at most every `reload_interval` seconds.
+
+        The stamp the cached data was loaded with is kept in the cache, so
+        that only the first process to notice the change clears it. If it is
+        missing, e.g. because it was evicted, the cached data may be older
+        than the files, so it is cleared too.
+        """
+        if not self._reload_interval:
+            return
+
+        now = time.monotonic()
+        if now < self._next_update_check:
+            return
+
+        self._next_update_check = now + self._reload_interval
+        stamp = self._last_update_stamp()
+        if stamp == self._update_stamp:
+            return
+
+        stamp_key = self._get_cache_key("last_update")
+        cached_stamp = self._cache.get(stamp_key)
+        if cached_stamp != stamp:
+            log.debug("%s may have been updated, clearing its cache." % self.json_dir)
+            self.delete_cache("versions")
+            self.delete_cache("regions")
+            self._cache.set(stamp_key, stamp, None)
+        self._update_stamp = stamp
 
     def last_modified_file_name(self, name):
         if name == "/":
@@ -168,6 +847,33 @@ class PDFileStorage(ProductDetailsStorage):
             fn = os.path.join(path, fn)
         return os.path.join(self.json_dir, fn)
 
+    def metadata_file_name(self, name, kind):
+        path, fn = os.path.split(name)
+        fn = ".{0}.{1}".format(fn, kind)
+        return os.path.join(self.json_dir, path, fn)
+
+    def read_metadata(self, name, kind):
+        try:
+            with open(self.metadata_file_name(name, kind)) as meta_fo:
+                return meta_fo.read() or None
+        except (IOError, ValueError):
+            return None
+
+    def write_metadata(self, name, kind, value):
+        meta_fn = self.metadata_file_name(name, kind)
+        if value:
+            with open(meta_fn, "w") as meta_fo:
+                meta_fo.write(value)
+        elif os.path.exists(meta_fn):
+            os.remove(meta_fn)
+
+    def etag(self, name):
+        if name.endswith("/"):
+            # no metadata is kept for directories
+            return None
+
+        return self.read_metadata(name, "etag")
+
     def last_modified(self, name):
         lm_fn = self.last_modified_file_name(name)
         if not os.path.exists(lm_fn):
@@ -180,23 +886,153 @@ class PDFileStorage(ProductDetailsStorage):
             return None
 
     def dir_data(self, name):
-        all_files = self.all_json_files()
-        if name == "versions":
-            all_files = [fn for fn in all_files if "/" not in fn]
-        else:
-            all_files = [fn for fn in all_files if fn.startswith(name + "/")]
+        if self._snapshot:
+            data = self.read_snapshot(name)
+            if data is not None:
+                return data
+
+        return self._load_json_dir(name)
+
+    def _updated_dir_data(self, name, parsed):
+        if self._snapshot:
+            # written from the same data by the update
+            data = self.read_snapshot(name)
+            if data is not None:
+                return data
+
+        return self._load_json_dir(name, parsed)
 
+    def _load_json_dir(self, name, parsed=None):
+        """
+        Load the JSON files of the requested folder name, except for those
+        whose data is in the `parsed` dict already.
+        """
         data = {}
-        for filename in all_files:
+        for filename in self.dir_file_names(name):
+            if parsed and filename in parsed:
+                data[filename] = parsed[filename]
+                continue
+
             content = self.content(filename)
             if content:
                 try:
-                    data[filename] = json.loads(content)
+                    data[filename] = json_loads(content)
                 except ValueError:
                     continue
 
         return data
 
+    def dir_file_names(self, name):
+        all_files = self.all_json_files()
+        if name == "versions":
+            return sorted(fn for fn in all_files if "/" not in fn)
+
+        return sorted(fn for fn in all_files if fn.startswith(name + "/"))
+
+    def file_data(self, name):
+        content = self.content(name)
+        if content:
+            try:
+                return json_loads(content)
+            except ValueError:
+                log.warn("Requested product details file %s is not JSON!" % name)
+
+        return None
+
+    def snapshot_file_name(self, name):
+        return os.path.join(self.json_dir, ".{0}.snapshot".format(name))
+
+    def _snapshot_stamp(self, name):
+        """
+        Return what identifies the current state of the JSON files of the
+        requested folder name, without reading them.
+        """
+        path = self.json_dir if name == "versions" else os.path.join(self.json_dir, name)
+        try:
+            with os.scandir(path) as entries:
+                files = [e for e in entries if e.name.endswith(".json") and e.is_file()]
+                return sorted(
+                    (e.name, e.stat().st_mtime_ns, e.stat().st_size) for e in files
+                )
+        except OSError:
+            return None
+
+    def _load_snapshot(self, name, stamp=None):
+        """
+        Return the stamp and data of the snapshot of the requested folder
+        name. With a `stamp`, the data is only loaded if the snapshot has it.
+        """
+        try:
+            with open(self.snapshot_file_name(name), "rb") as snapshot_fo:
+                snapshot_stamp = marshal.load(snapshot_fo)
+                if stamp is not None and snapshot_stamp != stamp:
+                    return snapshot_stamp, None
+
+                return snapshot_stamp, marshal.load(snapshot_fo)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None, None
+
+    def read_snapshot(self, name):
+        """
+        Return the parsed data of the requested folder name from its snapshot,
+        or None if there is none or the JSON files changed since it was written.
+        """
+        stamp = self._snapshot_stamp(name)
+        if stamp is None:
+            return None
+
+        snapshot_stamp, data = self._load_snapshot(name, stamp)
+        if snapshot_stamp != stamp:
+            return None
+
+        return data
+
+    def _unchanged_snapshot_data(self, name, stamp):
+        """
+        Return the data of the previous snapshot of the requested folder name
+        for the files that are unchanged since, according to the new `stamp`.
+        """
+        old_stamp, old_data = self._load_snapshot(name)
+        if not (old_stamp and stamp):
+            return {}
+
+        prefix = "" if name == "versions" else name + "/"
+        names = (prefix + entry[0] for entry in set(old_stamp).intersection(stamp))
+        return dict((fn, old_data[fn]) for fn in names if fn in old_data)
+
+    def write_snapshot(self, name, parsed=None):
+        """
+        Write the parsed data of the requested folder name to a single file
+        that `dir_data()` loads instead of every JSON file while it is current.
+        It is written with `marshal`, which unlike `pickle` cannot run code
+        when it is loaded, after the stamp that tells whether it is current.
+
+        Only the files that changed since the previous snapshot are parsed,
+        unless their data is in the `parsed` dict already.
+        """
+        stamp = self._snapshot_stamp(name)
+        known = self._unchanged_snapshot_data(name, stamp)
+        known.update(parsed or {})
+        data = self._load_json_dir(name, known)
+        tf = None
+        try:
+            tf = tempfile.NamedTemporaryFile(dir=self.json_dir, delete=False)
+            with tf:
+                marshal.dump(stamp, tf)
+                marshal.dump(data, tf)
+            # readable by the web processes, like the JSON files
+            os.chmod(tf.name, 0o644)
+            os.replace(tf.name, self.snapshot_file_name(name))
+        except (IOError, ValueError) as e:
+            log.warn("Could not write the snapshot of %s: %s" % (name, e))
+            if tf is not None and os.path.exists(tf.name):
+                os.remove(tf.name)
+
+    def _write_snapshots(self, names, parsed=None):
+        if self._snapshot:
+            for dirname in set(self._dir_name(name) for name in names):
+                self.write_snapshot(dirname, parsed)
+
     def content(self, name):
         filename = os.path.join(self.json_dir, name)
         try:
@@ -209,7 +1045,30 @@ class PDFileStorage(ProductDetailsStorage):
 
         return None
 
-    def update(self, name, content, last_modified):
+    def update(self, name, content, last_modified, etag=None, data=None):
+        changed = self._write(name, content, last_modified, etag)
+        if changed:
+            self._write_snapshots([name], {name: data} if data is not None else None)
+            self.invalidate_file(name, data)
+        elif not content and self._reload_interval:
+            # the cache is up to date with the files of this update
+            self._cache.set(
+                self._get_cache_key("last_update"), self._last_update_stamp(), None
+            )
+
+        return changed
+
+    def update_many(self, files):
+        files = [update_fields(f) for f in files]
+        changed = [f[0] for f in files if self._write(*f[:4])]
+        if changed:
+            parsed = dict((f[0], f[4]) for f in files if f[4] is not None)
+            self._write_snapshots(changed, parsed)
+            self.invalidate(changed, parsed)
+
+        return changed
+
+    def _write(self, name, content, last_modified, etag=None):
         # use '/' as name when updating the last_modified data for the dir
         if name == "/":
             name = ""
@@ -219,19 +1078,30 @@ class PDFileStorage(ProductDetailsStorage):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
+        changed = False
         if content:
-            log.debug("Writing new copy of %s to %s." % (name, self.json_dir))
-            tf = tempfile.NamedTemporaryFile(delete=False)
-            tf.write(content.encode("utf8"))
-            tf.close()
-
-            # lchmod is available on BSD-based Unixes only.
-            if hasattr(os, "lchmod"):
-                os.lchmod(tf.name, 0o644)
+            digest = content_digest(content)
+            if digest == self.read_metadata(name, "digest") and os.path.exists(
+                filename
+            ):
+                log.debug("%s did not change, not writing it." % name)
             else:
-                os.chmod(tf.name, 0o644)
+                log.debug("Writing new copy of %s to %s." % (name, self.json_dir))
+                tf = tempfile.NamedTemporaryFile(delete=False)
+                tf.write(content.encode("utf8"))
+                tf.close()
+
+                # lchmod is available on BSD-based Unixes only.
+                if hasattr(os, "lchmod"):
+                    os.lchmod(tf.name, 0o644)
+                else:
+                    os.chmod(tf.name, 0o644)
 
-            shutil.move(tf.name, filename)
+                shutil.move(tf.name, filename)
+                self.write_metadata(name, "digest", digest)
+                changed = True
+
+            self.write_metadata(name, "etag", etag)
             lm_fn = self.last_modified_file_name(name)
         else:
             # in this case `name` should be either empty string or "regions/"
@@ -240,6 +1110,8 @@ class PDFileStorage(ProductDetailsStorage):
         with open(lm_fn, "w") as lm_fo:
             lm_fo.write(last_modified)
 
+        return changed
+
     def all_json_files(self):
         json_files = []
         for root, dirs, files in os.walk(self.json_dir):
@@ -0,0 +1,487 @@
+"""
+Fetch the product details data from the server into a storage backend.
+
+The ``update_product_details`` management command uses the helpers in here,
+and :func:`async_update` does the same job on an asyncio event loop, e.g.
+to refresh the data from an ASGI application. :func:`update_from_source`
+imports the data from a local directory or archive instead.
+"""
+import asyncio
+import logging
+import os
+import re
+import tarfile
+import time
+import zipfile
+from collections import namedtuple
+from email.utils import formatdate
+from urllib.parse import unquote, urljoin, urlparse
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from product_details.utils import json_loads, settings_fallback
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    sync_to_async = None
+
+
+log = logging.getLogger("prod_details")
+
+FILE_LIST_RE = re.compile(r'href="([^"]+.json)"')
+
+# bytes to read from a streamed download at a time
+CHUNK_SIZE = 64 * 1024
+
+# The outcome of downloading a file. The content is None if the file was not
+# modified or could not be downloaded, `data` is the parsed content.
+Download = namedtuple(
+    "Download",
+    ["success", "content", "last_modified", "etag", "data"],
+    defaults=[None, None, None, None],
+)
+
+
+def parse_file_list(text):
+    """Return the set of JSON file names linked from a directory listing."""
+    return set(FILE_LIST_RE.findall(text))
+
+
+def parse_json(json_file, text):
+    """
+    Check that `text` is valid data for `json_file` and parse it.
+
+    Returns a (True, parsed data) tuple if it is, logs the reason and returns
+    (False, None) otherwise.
+    """
+    # Empty results are fishy
+    if not text:
+        log.warn(
+            "JSON source for %s was empty. Cowardly denying to "
+            "import empty data." % json_file
+        )
+        return False, None
+
+    # Try parsing the file, import if it's valid JSON.
+    try:
+        return True, json_loads(text)
+    except ValueError:
+        log.warn("Could not parse JSON data from %s. Skipping." % json_file)
+        return False, None
+
+
+def check_json(json_file, text):
+    """
+    Check that `text` is valid data for `json_file`.
+
+    Returns True if it is, logs the reason and returns False otherwise.
+    """
+    return parse_json(json_file, text)[0]
+
+
+def too_large(json_file, size, max_size):
+    """
+    Return True if `size` bytes (e.g. a Content-Length header) exceed
+    `max_size`, and log it. A `max_size` of 0 or None means no limit.
+    """
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        return False
+
+    if max_size and size > max_size:
+        log.warn(
+            "JSON source for %s is larger than %s bytes. Skipping."
+            % (json_file, max_size)
+        )
+        return True
+
+    return False
+
+
+def decode_body(json_file, body):
+    """Return the UTF-8 `body` of `json_file` as text, or None if it isn't."""
+    try:
+        return body.decode("utf8")
+    except UnicodeDecodeError:
+        log.warn("JSON source for %s is not UTF-8. Skipping." % json_file)
+        return None
+
+
+def read_body(json_file, chunks, max_size):
+    """
+    Join the byte `chunks` of a streamed download of `json_file` and decode
+    them. Stops reading and returns None if the body grows beyond `max_size`
+    bytes.
+    """
+    body = bytearray()
+    for chunk in chunks:
+        body += chunk
+        if too_large(json_file, len(body), max_size):
+            return None
+
+    return decode_body(json_file, body)
+
+
+def request_headers(storage, json_files, force=False):
+    """Return the headers to request each of `json_files` with, in order."""
+    if force:
+        return [{} for json_file in json_files]
+
+    meta = storage.file_meta_many(json_files)
+    headers = []
+    for json_file in json_files:
+        last_modified, etag = meta.get(json_file, (None, None))
+        file_headers = {}
+        if last_modified:
+            file_headers["If-Modified-Since"] = last_modified
+        if etag:
+            file_headers["If-None-Match"] = etag
+        headers.append(file_headers)
+
+    return headers
+
+
+def directory_not_modified(status_code, last_modified, headers):
+    """
+    Return True if the file list of a directory requested with `headers` did
+    not change since the last update, so its files do not need to be checked.
+    """
+    if status_code == 304:
+        return True
+
+    return bool(last_modified) and last_modified == headers.get("If-Modified-Since")
+
+
+def store_files(storage, dir, last_modified, results):
+    """
+    Store the downloaded files of a directory and its last-modified value.
+
+    :param results: iterable of (json_file, Download) pairs.
+
+    The directory's last-modified value is only stored if every file was
+    downloaded successfully. Returns True in that case, False otherwise.
+    """
+    had_errors = False
+    files = []
+    for json_file, download in results:
+        if not download.success:
+            had_errors = True
+        elif download.content is not None:
+            log.debug("Writing new copy of %s." % json_file)
+            files.append(
+                (
+                    json_file,
+                    download.content,
+                    download.last_modified,
+                    download.etag,
+                    download.data,
+                )
+            )
+
+    if files:
+        storage.update_many(files)
+
+    if had_errors:
+        log.warn('Update run had errors, not storing "last updated" timestamp.')
+        return False
+
+    # Save Last-Modified timestamp to detect updates against next time.
+    log.debug("Writing last-updated timestamp (%s)." % last_modified)
+    storage.update(dir or "/", "", last_modified)
+    return True
+
+
+async def async_update(
+    storage=None,
+    url=None,
+    concurrency=10,
+    force=False,
+    database="default",
+    warm_cache=False,
+    max_size=None,
+):
+    """
+    Update `storage` (defaults to one of the ``PROD_DETAILS_STORAGE`` class)
+    from the product details server at `url`.
+
+    This is the asyncio counterpart of the ``update_product_details``
+    command: up to `concurrency` files are downloaded at the same time on the
+    running event loop, while the storage is only accessed from a thread via
+    ``sync_to_async``. With `warm_cache` the updated data is loaded into the
+    cache when done. Files larger than `max_size` bytes (defaults to
+    ``PROD_DETAILS_MAX_FILE_SIZE``) are rejected. Requires the ``httpx``
+    package.
+
+    Returns True if every file was updated successfully.
+    """
+    if httpx is None or sync_to_async is None:
+        raise ImproperlyConfigured("async_update() requires httpx and asgiref.")
+
+    if storage is None:
+        storage = import_string(settings_fallback("PROD_DETAILS_STORAGE"))()
+    url = url or settings_fallback("PROD_DETAILS_URL")
+    if max_size is None:
+        max_size = settings_fallback("PROD_DETAILS_MAX_FILE_SIZE")
+    semaphore = asyncio.Semaphore(concurrency)
+    success = True
+    async with httpx.AsyncClient() as client:
+        for dir in ("", "regions/"):
+            updated = await _async_update_directory(
+                client, semaphore, storage, url, dir, force, database, max_size
+            )
+            success = success and updated
+
+    if warm_cache:
+        for name in ("versions", "regions"):
+            await sync_to_async(storage.warm_cache)(name)
+
+    return success
+
+
+async def _async_update_directory(
+    client, semaphore, storage, url, dir, force, database, max_size
+):
+    src = urljoin(url, dir)
+    log.debug("Grabbing list of JSON files from the server from %s" % src)
+    headers = await sync_to_async(request_headers)(storage, [dir or "/"], force)
+    try:
+        resp = await client.get(src, headers=headers[0])
+    except httpx.HTTPError as e:
+        log.warn("Could not retrieve file list: %s" % e)
+        return False
+
+    last_modified = resp.headers.get("Last-Modified")
+    if directory_not_modified(resp.status_code, last_modified, headers[0]):
+        log.debug("%s was not modified." % src)
+        return True
+
+    json_files = [urljoin(dir, fn) for fn in sorted(parse_file_list(resp.text))]
+    if not json_files:
+        return True
+
+    headers = await sync_to_async(request_headers)(storage, json_files, force)
+    results = await asyncio.gather(
+        *[
+            _async_fetch_json_file(
+                client, semaphore, urljoin(url, fn), fn, hdrs, max_size
+            )
+            for fn, hdrs in zip(json_files, headers)
+        ]
+    )
+
+    return await sync_to_async(_store_directory)(
+        storage, dir, last_modified, zip(json_files, results), database
+    )
+
+
+async def _async_fetch_json_file(
+    client, semaphore, url, json_file, headers, max_size
+):
+    """
+    Download a JSON file and check its validity. Returns a `Download`.
+    """
+    async with semaphore:
+        log.info("Updating %s from server" % json_file)
+        try:
+            async with client.stream("GET", url, headers=headers) as resp:
+                if resp.status_code == 304:
+                    log.debug("%s was not modified." % json_file)
+                    return Download(True)
+
+                if too_large(json_file, resp.headers.get("Content-Length"), max_size):
+                    return Download(False)
+
+                body = bytearray()
+                async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                    body += chunk
+                    if too_large(json_file, len(body), max_size):
+                        return Download(False)
+        except httpx.HTTPError as e:
+            log.warn("Error retrieving %s: %s" % (json_file, e))
+            return Download(False)
+
+    text = decode_body(json_file, body)
+    if text is None:
+        return Download(False)
+
+    valid, data = parse_json(json_file, text)
+    if not valid:
+        return Download(False)
+
+    return Download(
+        True, text, resp.headers.get("Last-Modified"), resp.headers.get("ETag"), data
+    )
+
+
+def _store_directory(storage, dir, last_modified, results, database):
+    if storage.storage_type == "db":
+        with transaction.atomic(using=database):
+            return store_files(storage, dir, last_modified, results)
+
+    return store_files(storage, dir, last_modified, results)
+
+
+class DirectorySource(object):
+    """
+    Reads the files from a local directory laid out like the server, e.g. the
+    ``PROD_DETAILS_DIR`` of another project.
+
+    The last-modified values written by ``PDFileStorage`` are used when they
+    exist, the modification times of the files otherwise.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def file_list(self, dir):
+        """Return the last-modified value and the JSON files of `dir`."""
+        path = os.path.join(self.path, dir)
+        try:
+            names = sorted(fn for fn in os.listdir(path) if fn.endswith(".json"))
+        except OSError:
+            return None, []
+
+        last_modified = self._read(os.path.join(path, ".last_update"))
+        if not last_modified:
+            mtimes = [os.path.getmtime(os.path.join(path, fn)) for fn in names]
+            last_modified = formatdate(max(mtimes or [0]), usegmt=True)
+
+        return last_modified, [dir + fn for fn in names]
+
+    def fetch(self, json_file):
+        """Read a JSON file and check its validity. Returns a `Download`."""
+        filename = os.path.join(self.path, json_file)
+        text = self._read(filename)
+        valid, data = parse_json(json_file, text)
+        if not valid:
+            return Download(False)
+
+        path, fn = os.path.split(filename)
+        last_modified = self._read(os.path.join(path, ".%s.last_modified" % fn))
+        if not last_modified:
+            last_modified = formatdate(os.path.getmtime(filename), usegmt=True)
+
+        return Download(True, text, last_modified, data=data)
+
+    def _read(self, filename):
+        try:
+            with open(filename, encoding="utf8") as fo:
+                return fo.read()
+        except (IOError, ValueError):
+            return None
+
+
+class ArchiveSource(object):
+    """
+    Reads the files from a tar or zip archive of a directory laid out like the
+    server. The files may be in a subdirectory of the archive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if info.filename.endswith(".json"):
+                        self.files[info.filename] = (
+                            archive.read(info),
+                            _zip_mtime(info.date_time),
+                        )
+        else:
+            with tarfile.open(path) as archive:
+                for member in archive.getmembers():
+                    if member.isfile() and member.name.endswith(".json"):
+                        fo = archive.extractfile(member)
+                        self.files[member.name] = (fo.read(), member.mtime)
+
+        # the data is in the directory of the top-most files
+        root = min((os.path.dirname(fn) for fn in self.files), key=len, default="")
+        root = root + "/" if root else ""
+        self.files = dict(
+            (fn.replace(root, "", 1), data)
+            for fn, data in self.files.items()
+            if fn.startswith(root)
+        )
+
+    def file_list(self, dir):
+        """Return the last-modified value and the JSON files of `dir`."""
+        names = sorted(
+            fn for fn in self.files if os.path.dirname(fn) + "/" == (dir or "/")
+        )
+        mtime = max([self.files[fn][1] for fn in names] or [0])
+        return formatdate(mtime, usegmt=True), names
+
+    def fetch(self, json_file):
+        """Read a JSON file and check its validity. Returns a `Download`."""
+        content, mtime = self.files[json_file]
+        try:
+            text = content.decode("utf8")
+        except ValueError:
+            text = None
+
+        valid, data = parse_json(json_file, text)
+        if not valid:
+            return Download(False)
+
+        return Download(True, text, formatdate(mtime, usegmt=True), data=data)
+
+
+def _zip_mtime(date_time):
+    return time.mktime(date_time + (0, 0, -1))
+
+
+def get_source(location):
+    """
+    Return the source to import the files from for a local directory, a
+    ``file://`` URL of one, or a tar or zip archive.
+
+    Raises a ValueError for anything else.
+    """
+    if location.startswith("file://"):
+        location = unquote(urlparse(location).path)
+
+    if os.path.isdir(location):
+        return DirectorySource(location)
+
+    if os.path.isfile(location) and (
+        zipfile.is_zipfile(location) or tarfile.is_tarfile(location)
+    ):
+        return ArchiveSource(location)
+
+    raise ValueError("%s is not a directory or an archive." % location)
+
+
+def update_from_source(storage, source, force=False, database="default"):
+    """
+    Update `storage` from a `DirectorySource` or an `ArchiveSource`.
+
+    Like the ``update_product_details`` command, a directory is skipped if
+    its last-modified value did not change, and its files are written with
+    a single ``update_many()``. Returns True if every file was valid.
+    """
+    success = True
+    for dir in ("", "regions/"):
+        last_modified, json_files = source.file_list(dir)
+        if not json_files:
+            continue
+
+        headers = request_headers(storage, [dir or "/"], force)
+        if directory_not_modified(200, last_modified, headers[0]):
+            log.debug("%s was not modified." % (dir or "/"))
+            continue
+
+        results = [(fn, source.fetch(fn)) for fn in json_files]
+        updated = _store_directory(storage, dir, last_modified, results, database)
+        success = success and updated
+
+    return success
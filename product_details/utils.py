@@ -1,5 +1,11 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
 
 from product_details import settings_defaults
 
@@ -12,6 +18,33 @@ def settings_fallback(key):
         return getattr(settings_defaults, key)
 
 
+@lru_cache(maxsize=None)
+def get_json_loads():
+    """
+    Return the function configured in PROD_DETAILS_JSON_LOADS.
+
+    It is only imported once, until the setting changes.
+    """
+    return import_string(settings_fallback("PROD_DETAILS_JSON_LOADS"))
+
+
+def json_loads(text):
+    """
+    Parse JSON `text` with the function configured in PROD_DETAILS_JSON_LOADS.
+
+    The function must raise a ValueError (or a subclass) for invalid JSON.
+    """
+    return get_json_loads()(text)
+
+
+def _reset_json_loads(setting, **kwargs):
+    if setting == "PROD_DETAILS_JSON_LOADS":
+        get_json_loads.cache_clear()
+
+
+setting_changed.connect(_reset_json_loads)
+
+
 def get_django_cache(cache_name):
     try:
         from django.core.cache import caches  # django 1.7+
@@ -24,3 +57,38 @@ def get_django_cache(cache_name):
     except ImproperlyConfigured:
         # dance to get around not-setup-django at import time
         return {}
+
+
+class LRUCache(object):
+    """A small thread-safe mapping that evicts the least recently used keys."""
+
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
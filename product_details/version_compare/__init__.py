@@ -1,6 +1,7 @@
 """Version comparison module for Mozilla-style application versions."""
 import re
 from functools import total_ordering
+from operator import itemgetter
 
 from product_details.version_compare.decorators import memoize
 from product_details.version_compare.utils import uniquifier
@@ -20,41 +21,82 @@ _version_re = re.compile(
     re.VERBOSE,
 )
 
+# fields of the version dicts
+_VERSION_FIELDS = (
+    "major",
+    "minor1",
+    "minor2",
+    "minor3",
+    "alpha",
+    "alpha_ver",
+    "pre",
+    "pre_ver",
+)
+
+# alpha/beta part of version integers, anything else is a release
+_ALPHA_INTS = {"a": 0, "b": 1}
+
+# version integer of strings that are not versions
+_NO_VERSION_INT = 200100
+
 
 @total_ordering
 class Version(object):
-    """An object representing a version."""
+    """An immutable object representing a version."""
 
-    _version = None
-    _version_int = None
-    _version_dict = None
+    __slots__ = _VERSION_FIELDS + ("_version", "_version_int")
 
     def __init__(self, version):
         """Version constructor."""
         try:
             # Parse version.
             assert version
-            self._version = version
-            self._version_int = version_int(version)
+            set_field = super(Version, self).__setattr__
+            set_field("_version", version)
+            set_field("_version_int", version_int(version))
             assert version_int != 0
-            self._version_dict = version_dict(version)
 
             # Make parsed data available as properties.
-            for key, val in self._version_dict.items():
-                setattr(self, key, val)
+            for key, val in version_dict(version).items():
+                set_field(key, val)
 
         except AssertionError as e:
             raise ValueError("Error parsing version: %s" % e)
 
+    @classmethod
+    def interned(cls, version):
+        """Return the shared `Version` of a version string, creating it once."""
+        return _interned_version(cls, version)
+
+    @property
+    def _version_dict(self):
+        return dict((key, getattr(self, key)) for key in _VERSION_FIELDS)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Version objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Version objects are immutable")
+
+    def __reduce__(self):
+        return (self.__class__, (self._version,))
+
     def __str__(self):
         return str(self._version)
 
     def __eq__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
         return self._version_int == other._version_int
 
     def __lt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
         return self._version_int < other._version_int
 
+    def __hash__(self):
+        return hash(self._version_int)
+
     @property
     def is_beta(self):
         """
@@ -77,9 +119,12 @@ class Version(object):
         return simplify_version(self._version)
 
 
-def version_list(
-    releases, key=None, reverse=True, hide_below="0.0", filter=lambda v: True
-):
+@memoize
+def _interned_version(cls, version):
+    return cls(version)
+
+
+def version_list(releases, key=None, reverse=True, hide_below="0.0", filter=None):
     """
     Build a sorted list of simplified versions.
 
@@ -94,16 +139,35 @@ def version_list(
         def key(x):
             return x[1]  # Default: Sort by release date.
 
-    lowest = Version(hide_below)
+    lowest = version_int(hide_below)
     versions = []
     for v, released in sorted(releases.items(), key=key, reverse=reverse):
-        ver = Version(v)
-        if ver < lowest or not filter(ver):
+        if version_int(v) < lowest or (filter and not filter(Version(v))):
             continue
-        versions.append(ver.simplified)
+        versions.append(simplify_version(v))
     return uniquifier(versions)
 
 
+def version_ints(versions):
+    """Return the list of version integers of ``versions``, in order.
+
+    Unlike calling `version_int()` on each of them, the versions are parsed
+    straight into integers and nothing is memoized.
+    """
+    return [_parse_version_int(str(v)) for v in versions]
+
+
+def sort_versions(versions, reverse=False):
+    """Return ``versions`` sorted like `Version` objects would be.
+
+    Every version is only parsed once to build its sort key.
+    """
+    versions = list(versions)
+    pairs = list(zip(version_ints(versions), versions))
+    pairs.sort(key=itemgetter(0), reverse=reverse)
+    return [v for _, v in pairs]
+
+
 def dict_from_int(version_int):
     """Converts a version integer into a dictionary with major/minor/...
     info."""
@@ -143,24 +207,25 @@ def version_dict(version):
 
 @memoize
 def version_int(version):
-    version_data = version_dict(str(version))
+    return _parse_version_int(str(version))
 
-    d = {}
-    for key in ["alpha_ver", "major", "minor1", "minor2", "minor3", "pre_ver"]:
-        d[key] = version_data.get(key) or 0
-    atrans = {"a": 0, "b": 1}
-    d["alpha"] = atrans.get(version_data["alpha"], 2)
-    d["pre"] = 0 if version_data["pre"] else 1
 
+def _parse_version_int(version):
+    """Turn a version string into an integer without building its dict."""
+    match = _version_re.match(version)
+    if not match:
+        return _NO_VERSION_INT
+
+    major, minor1, minor2, minor3, alpha, alpha_ver, pre, pre_ver = match.groups()
     v = "%d%02d%02d%02d%d%02d%d%02d" % (
-        d["major"],
-        d["minor1"],
-        d["minor2"],
-        d["minor3"],
-        d["alpha"],
-        d["alpha_ver"],
-        d["pre"],
-        d["pre_ver"],
+        int(major),
+        int(minor1),
+        int(minor2 or 0),
+        int(minor3 or 0),
+        _ALPHA_INTS.get(alpha, 2),
+        int(alpha_ver or 0),
+        0 if pre else 1,
+        int(pre_ver or 0),
     )
     return int(v)
 
@@ -1,21 +1,32 @@
 import functools
-from pickle import dumps
 
 
-def memoize(fctn):
+def memoize(fctn=None, maxsize=4096):
     """
-    Memoizing decorator, courtesy of:
-    http://pko.ch/2008/08/22/memoization-in-python-easier-than-what-it-should-be/
+    Memoizing decorator keeping the results of the last `maxsize` calls.
+
+    Arguments are used as keys directly, calls with unhashable arguments are
+    not memoized. The decorated function has the ``cache_info()`` and
+    ``cache_clear()`` methods of `functools.lru_cache`.
     """
-    memory = {}
+    if fctn is None:
+        return functools.partial(memoize, maxsize=maxsize)
+
+    cached = functools.lru_cache(maxsize=maxsize)(fctn)
 
     @functools.wraps(fctn)
     def memo(*args, **kwargs):
-        haxh = dumps((args, sorted(kwargs.items())))
-        if haxh not in memory:
-            memory[haxh] = fctn(*args, **kwargs)
-        return memory[haxh]
+        try:
+            return cached(*args, **kwargs)
+        except TypeError:
+            try:
+                hash((args, tuple(kwargs.items())))
+            except TypeError:
+                return fctn(*args, **kwargs)
+            raise
 
+    memo.cache_info = cached.cache_info
+    memo.cache_clear = cached.cache_clear
     if memo.__doc__:
         memo.__doc__ = "\n".join([memo.__doc__, "This function is memoized."])
     return memo
@@ -28,6 +28,7 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=["Django>=2.2", "requests>=2.21.0"],
+    extras_require={"async": ["asgiref>=3.2", "httpx>=0.18"]},
     classifiers=[
         "Development Status :: 4 - Beta",
         "Environment :: Web Environment",
@@ -0,0 +1,74 @@
+"""A local stand-in for the product details server, for offline tests."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInServer(object):
+    """
+    Serves `files` (a dict of file name to content) over HTTP on localhost.
+
+    Directories get an HTML index linking to their files, like the real
+    server. Every response carries `last_modified` as its Last-Modified
+    header, and a matching If-Modified-Since header gets a 304. The paths of
+    all requests are recorded in `requests`.
+
+        with StandInServer({"firefox_versions.json": "{}"}) as server:
+            requests.get(server.url + "firefox_versions.json")
+    """
+
+    def __init__(self, files, last_modified="Sat, 01 Jan 2000 00:00:00 GMT"):
+        self.files = files
+        self.last_modified = last_modified
+        self.requests = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.url = "http://127.0.0.1:%s/" % self._server.server_port
+
+    def __enter__(self):
+        threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def index(self, dir):
+        names = [
+            fn.replace(dir, "", 1) for fn in sorted(self.files) if fn.startswith(dir)
+        ]
+        names = [fn for fn in names if "/" not in fn]
+        return "".join('<a href="%s">%s</a>\n' % (fn, fn) for fn in names)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.lstrip("/")
+                server.requests.append(path)
+                if path == "" or path.endswith("/"):
+                    body = server.index(path)
+                elif path in server.files:
+                    body = server.files[path]
+                else:
+                    self.send_error(404)
+                    return
+
+                if self.headers.get("If-Modified-Since") == server.last_modified:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                body = body.encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Last-Modified", server.last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
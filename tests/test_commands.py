@@ -1,11 +1,16 @@
-from django.core.management import call_command
+import json
+import os.path
+from tempfile import mkdtemp
+
+from django.core.management import CommandError, call_command
 from django.test.testcases import TestCase
 
 import responses
 from mock import patch
-from nose.tools import eq_
+from nose.tools import eq_, ok_
 
 from product_details.storage import ProductDetailsStorage
+from tests.server import StandInServer
 
 
 class MockStorage(ProductDetailsStorage):
@@ -29,9 +34,24 @@ class MockStorage(ProductDetailsStorage):
 
         return None
 
-    def update(self, name, content, last_modified):
+    def update(self, name, content, last_modified, etag=None, data=None):
+        changed = content != self.content(name)
         self.documents[name] = {"content": content, "last_modified": last_modified}
+        if etag:
+            self.documents[name]["etag"] = etag
         self.delete_cache(name)
+        return changed
+
+    def etag(self, name):
+        return self.documents.get(name, {}).get("etag")
+
+    def dir_data(self, name):
+        data = {}
+        for fn, doc in self.documents.items():
+            if fn.endswith(".json") and (os.path.dirname(fn) or "versions") == name:
+                data[fn] = json.loads(doc["content"])
+
+        return data
 
 
 class UpdateProductDetailsTests(TestCase):
@@ -70,3 +90,163 @@ class UpdateProductDetailsTests(TestCase):
                 "last_modified": "Sat, 01 Jan 2000 00:00:00 GMT",
             },
         )
+
+    @responses.activate
+    def test_run_workers(self):
+        responses.add(
+            responses.GET,
+            "http://example.com",
+            body="".join('<a href="%s.json"></a>' % n for n in range(10)),
+            adding_headers={"Last-Modified": "Sun, 02 Jan 2000 00:00:00 GMT"},
+        )
+        responses.add(responses.GET, "http://example.com/regions/", body="")
+        for n in range(10):
+            responses.add(responses.GET, "http://example.com/%s.json" % n, body=str(n))
+
+        with self.settings(PROD_DETAILS_URL="http://example.com/"):
+            call_command("update_product_details", workers=4)
+
+        for n in range(10):
+            eq_(self.storage.content("%s.json" % n), str(n))
+        eq_(self.storage.last_modified("/"), "Sun, 02 Jan 2000 00:00:00 GMT")
+
+    @responses.activate
+    def test_run_workers_errors(self):
+        """The directory timestamp should only be stored if all files succeed."""
+        responses.add(
+            responses.GET,
+            "http://example.com",
+            body='<a href="good.json"></a><a href="bad.json"></a>',
+            adding_headers={"Last-Modified": "Sun, 02 Jan 2000 00:00:00 GMT"},
+        )
+        responses.add(responses.GET, "http://example.com/regions/", body="")
+        responses.add(responses.GET, "http://example.com/good.json", body="{}")
+        responses.add(responses.GET, "http://example.com/bad.json", body="not json")
+
+        with self.settings(PROD_DETAILS_URL="http://example.com/"):
+            call_command("update_product_details", workers=4)
+
+        eq_(self.storage.content("good.json"), "{}")
+        ok_("bad.json" not in self.storage.documents)
+        ok_("/" not in self.storage.documents)
+
+    @responses.activate
+    def test_max_file_size(self):
+        responses.add(
+            responses.GET,
+            "http://example.com",
+            body='<a href="small.json"></a><a href="big.json"></a>',
+            adding_headers={"Last-Modified": "Sun, 02 Jan 2000 00:00:00 GMT"},
+        )
+        responses.add(responses.GET, "http://example.com/regions/", body="")
+        responses.add(responses.GET, "http://example.com/small.json", body="[1]")
+        responses.add(responses.GET, "http://example.com/big.json", body="[1, 2, 3]")
+
+        with self.settings(
+            PROD_DETAILS_URL="http://example.com/", PROD_DETAILS_MAX_FILE_SIZE=8
+        ):
+            call_command("update_product_details")
+
+        eq_(self.storage.content("small.json"), "[1]")
+        ok_("big.json" not in self.storage.documents)
+        ok_("/" not in self.storage.documents)
+
+    @responses.activate
+    def test_directory_not_modified(self):
+        """Files should not be requested if the file list was not modified."""
+        self.storage.update("/", "", "Sun, 02 Jan 2000 00:00:00 GMT")
+        self.storage.update("regions/", "", "Sun, 02 Jan 2000 00:00:00 GMT")
+        responses.add(responses.GET, "http://example.com", status=304)
+        responses.add(
+            responses.GET,
+            "http://example.com/regions/",
+            body='<a href="de.json">de.json</a>',
+            adding_headers={"Last-Modified": "Sun, 02 Jan 2000 00:00:00 GMT"},
+        )
+
+        with self.settings(PROD_DETAILS_URL="http://example.com/"):
+            call_command("update_product_details")
+
+        eq_(len(responses.calls), 2)
+        eq_(
+            responses.calls[0].request.headers["If-Modified-Since"],
+            "Sun, 02 Jan 2000 00:00:00 GMT",
+        )
+
+    @responses.activate
+    def test_directory_not_modified_force(self):
+        self.storage.update("/", "", "Sun, 02 Jan 2000 00:00:00 GMT")
+        responses.add(
+            responses.GET,
+            "http://example.com",
+            body='<a href="test.json">test.json</a>',
+            adding_headers={"Last-Modified": "Sun, 02 Jan 2000 00:00:00 GMT"},
+        )
+        responses.add(responses.GET, "http://example.com/regions/", body="")
+        responses.add(responses.GET, "http://example.com/test.json", body="{}")
+
+        with self.settings(PROD_DETAILS_URL="http://example.com/"):
+            call_command("update_product_details", force=True)
+
+        ok_("If-Modified-Since" not in responses.calls[0].request.headers)
+        eq_(self.storage.content("test.json"), "{}")
+
+    @responses.activate
+    def test_etag(self):
+        self.storage.update("test.json", "{}", "Sat, 01 Jan 2000 00:00:00 GMT", '"a"')
+        responses.add(
+            responses.GET,
+            "http://example.com",
+            body='<a href="test.json">test.json</a>',
+        )
+        responses.add(responses.GET, "http://example.com/regions/", body="")
+        responses.add(
+            responses.GET,
+            "http://example.com/test.json",
+            body='{"foo": "bar"}',
+            adding_headers={"ETag": '"b"'},
+        )
+
+        with self.settings(PROD_DETAILS_URL="http://example.com/"):
+            call_command("update_product_details")
+
+        eq_(responses.calls[1].request.headers["If-None-Match"], '"a"')
+        eq_(self.storage.etag("test.json"), '"b"')
+
+    @responses.activate
+    def test_warm_cache(self):
+        responses.add(
+            responses.GET,
+            "http://example.com",
+            body='<a href="test.json">test.json</a>',
+        )
+        responses.add(responses.GET, "http://example.com/regions/", body="")
+        responses.add(responses.GET, "http://example.com/test.json", body="[1]")
+        self.storage.clear_cache()
+
+        with self.settings(PROD_DETAILS_URL="http://example.com/"):
+            call_command("update_product_details", warm_cache=True)
+
+        eq_(self.storage._cache.get("prod-details:versions"), {"test.json": [1]})
+
+    def test_stand_in_server(self):
+        files = {"test.json": '{"foo": "bar"}', "regions/de.json": '{"de": "Germany"}'}
+        with StandInServer(files) as server:
+            call_command("update_product_details", source=server.url)
+
+        eq_(self.storage.content("regions/de.json"), '{"de": "Germany"}')
+        eq_(self.storage.last_modified("/"), server.last_modified)
+
+    def test_source_directory(self):
+        path = mkdtemp()
+        os.mkdir(os.path.join(path, "regions"))
+        with open(os.path.join(path, "regions", "de.json"), "w") as fo:
+            fo.write('{"de": "Germany"}')
+
+        call_command("update_product_details", source=path)
+        eq_(self.storage.content("regions/de.json"), '{"de": "Germany"}')
+        ok_(self.storage.last_modified("regions/"))
+
+    def test_bad_source(self):
+        with self.assertRaises(CommandError):
+            call_command("update_product_details", source="/does/not/exist")
@@ -0,0 +1,121 @@
+from datetime import date
+
+from django.test import SimpleTestCase
+from mock import Mock, patch
+from nose.tools import eq_, ok_
+
+import product_details
+from product_details.releases import ReleaseIndex
+from product_details.version_compare import version_list
+
+
+MAJOR = {"1.0": "2004-11-09", "2.0": "2006-10-24", "3.0": "2008-06-17"}
+STABILITY = {"1.0.1": "2005-02-24", "2.0.0.1": "2006-12-19"}
+DEVELOPMENT = {"3.0b1": "2007-11-19", "3.0rc1": "2008-05-16"}
+
+
+class ReleaseIndexTests(SimpleTestCase):
+    index = ReleaseIndex([MAJOR, STABILITY, DEVELOPMENT])
+
+    def test_release_date(self):
+        eq_(self.index.release_date("2.0"), "2006-10-24")
+        eq_(self.index.release_date("2.0.0"), "2006-10-24")
+        eq_(self.index.release_date("3.0b1"), "2007-11-19")
+        ok_(self.index.release_date("4.0") is None)
+
+    def test_releases_between(self):
+        eq_(
+            self.index.releases_between("2005-01-01", "2006-12-19"),
+            ["1.0.1", "2.0", "2.0.0.1"],
+        )
+        eq_(
+            self.index.releases_between(date(2007, 1, 1), date(2008, 6, 17)),
+            ["3.0b1", "3.0rc1", "3.0"],
+        )
+        eq_(self.index.releases_between("2009-01-01", "2010-01-01"), [])
+
+    def test_latest_release_before(self):
+        eq_(self.index.latest_release_before("2006-10-24"), "1.0.1")
+        eq_(self.index.latest_release_before(date(2006, 10, 25)), "2.0")
+        ok_(self.index.latest_release_before("2004-11-09") is None)
+
+
+class ProductDetailsReleasesTests(SimpleTestCase):
+    def setUp(self):
+        self.pd = product_details.ProductDetails()
+        self.pd._real_storage = Mock()
+        self.files = {
+            "firefox_history_major_releases.json": MAJOR,
+            "firefox_history_stability_releases.json": STABILITY,
+            "firefox_history_development_releases.json": DEVELOPMENT,
+        }
+        self.pd._storage.data.side_effect = lambda name: dict(self.files.get(name, {}))
+        self.pd._storage.data_many.side_effect = lambda names: dict(
+            (name, dict(self.files.get(name, {}))) for name in names
+        )
+
+    def test_queries(self):
+        eq_(self.pd.release_date("firefox", "1.0.1"), "2005-02-24")
+        eq_(
+            self.pd.releases_between("firefox", "2008-01-01", "2008-12-31"),
+            ["3.0rc1", "3.0"],
+        )
+        eq_(self.pd.latest_release_before("firefox", "2005-01-01"), "1.0")
+        ok_(self.pd.release_date("thunderbird", "1.0") is None)
+
+    def test_single_fetch(self):
+        self.pd.release_date("firefox", "1.0")
+        self.pd._storage.data_many.assert_called_once_with(
+            [
+                "firefox_history_major_releases.json",
+                "firefox_history_stability_releases.json",
+                "firefox_history_development_releases.json",
+            ]
+        )
+        ok_(not self.pd._storage.data.called)
+
+    @patch("product_details.ReleaseIndex", wraps=ReleaseIndex)
+    def test_index_reused(self, index_mock):
+        self.pd.release_date("firefox", "1.0")
+        self.pd.release_date("firefox", "2.0")
+        eq_(index_mock.call_count, 1)
+        self.files["firefox_history_major_releases.json"] = {"4.0": "2011-03-22"}
+        eq_(self.pd.release_date("firefox", "4.0"), "2011-03-22")
+        eq_(index_mock.call_count, 2)
+
+    def test_version_list(self):
+        eq_(
+            self.pd.version_list("firefox_history_major_releases"),
+            ["3.0", "2.0", "1.0"],
+        )
+        eq_(
+            self.pd.version_list("firefox_history_major_releases", hide_below="2.0"),
+            ["3.0", "2.0"],
+        )
+
+    @patch("product_details.version_list", wraps=version_list)
+    def test_version_list_reused(self, version_list_mock):
+        def is_major(v):
+            return v.minor1 == 0
+
+        kwargs = {"hide_below": "2.0", "filter": is_major}
+        eq_(self.pd.version_list("firefox_history_major_releases", **kwargs), ["3.0", "2.0"])
+        self.pd.version_list("firefox_history_major_releases", **kwargs)
+        eq_(version_list_mock.call_count, 1)
+        self.pd.version_list("firefox_history_major_releases", reverse=False)
+        eq_(version_list_mock.call_count, 2)
+        self.files["firefox_history_major_releases.json"] = {"4.0": "2011-03-22"}
+        eq_(self.pd.version_list("firefox_history_major_releases", **kwargs), ["4.0"])
+        eq_(version_list_mock.call_count, 3)
+
+    @patch("product_details.version_list", wraps=version_list)
+    def test_version_list_sort_key(self, version_list_mock):
+        def by_version(item):
+            return item[0]
+
+        eq_(
+            self.pd.version_list("firefox_history_major_releases", key=by_version),
+            ["3.0", "2.0", "1.0"],
+        )
+        self.pd.version_list("firefox_history_major_releases", key=by_version)
+        eq_(version_list_mock.call_count, 1)
@@ -3,20 +3,28 @@ Most of the version_compare tests are directly migrated from mozilla-central's r
 implementation.
 """
 import json
+import os
+import threading
+import time
 from collections import defaultdict
 from tempfile import mkdtemp
 
 from datetime import datetime
 from mock import Mock, patch, call
 from nose.tools import eq_, ok_
+from django.test import override_settings
 from django.test.testcases import TestCase
 
 import product_details
-from product_details import settings_defaults
-from product_details import storage
+from product_details import settings_defaults, signals
+from product_details import storage, sync, utils
 from product_details.models import ProductDetailsFile
 
 
+def fake_json_loads(text):
+    return {"parsed": text}
+
+
 class PDStorageClassMixin(object):
     storage = None
 
@@ -63,6 +71,29 @@ class PDStorageClassMixin(object):
             content_mock.assert_called_with("versions")
             eq_(content_mock.call_count, 2)
 
+    def test_warm_cache(self):
+        good_data = {"the_dude.json": {"dude": "abiding"}}
+        with patch.object(
+            self.storage, "dir_data", return_value=good_data
+        ) as content_mock:
+            eq_(self.storage.warm_cache("versions"), good_data)
+            eq_(self.storage.data("the_dude.json"), good_data["the_dude.json"])
+            content_mock.assert_called_once_with("versions")
+
+    def test_data_many(self):
+        self.storage.clear_cache()
+        self.storage.update("walter.json", '{"walter": "bowls"}', "a")
+        self.storage.update("regions/de.json", '{"de": "Germany"}', "a")
+        eq_(
+            self.storage.data_many(["walter.json", "regions/de.json", "regions/xx.json"]),
+            {
+                "walter.json": {"walter": "bowls"},
+                "regions/de.json": {"de": "Germany"},
+                "regions/xx.json": None,
+            },
+        )
+        ok_("regions/de.json" in self.storage.file_names("regions"))
+
     def test_no_cache_empty_data(self):
         """Empty data should not be cached."""
         with patch.object(self.storage, "dir_data", return_value={}) as content_mock:
@@ -79,6 +110,48 @@ class PDStorageClassMixin(object):
         eq_(self.storage.content("dude.json"), "bowling")
         eq_(self.storage.last_modified("dude.json"), "just now")
 
+    def test_update_unchanged(self):
+        ok_(self.storage.update("maude.json", "art", "a"))
+        with patch.object(self.storage, "invalidate") as invalidate_mock:
+            ok_(not self.storage.update("maude.json", "art", "b", etag='"x"'))
+            eq_(self.storage.update_many([("maude.json", "art", "c", None)]), [])
+            ok_(not invalidate_mock.called)
+        eq_(self.storage.content("maude.json"), "art")
+        eq_(self.storage.last_modified("maude.json"), "c")
+
+    def test_directory_etag(self):
+        self.storage.update("dude.json", "[1]", "a", etag='"x"')
+        self.storage.update("/", "", "b")
+        eq_(
+            sync.request_headers(self.storage, ["/", "regions/", "dude.json"]),
+            [
+                {"If-Modified-Since": "b"},
+                {},
+                {"If-Modified-Since": "a", "If-None-Match": '"x"'},
+            ],
+        )
+        ok_(self.storage.etag("/") is None)
+        ok_(self.storage.etag("regions/") is None)
+
+    def test_update_etag(self):
+        self.storage.update("dude.json", "abide", "a", etag='"abc"')
+        eq_(self.storage.etag("dude.json"), '"abc"')
+        self.storage.update_many([("dude.json", "bowling", "a", '"def"')])
+        eq_(self.storage.etag_many(["dude.json"]), {"dude.json": '"def"'})
+        self.storage.update("dude.json", "abide", "a")
+        ok_(self.storage.etag("dude.json") is None)
+
+    def test_update_many_files(self):
+        self.storage.update_many(
+            [("dude.json", "abide", "a", None), ("bunny.json", "b", "b", None)]
+        )
+        eq_(self.storage.content("dude.json"), "abide")
+        eq_(self.storage.content("bunny.json"), "b")
+        eq_(
+            self.storage.last_modified_many(["dude.json", "bunny.json"]),
+            {"dude.json": "a", "bunny.json": "b"},
+        )
+
     def test_last_modified_datetime(self):
         self.storage.update("dude.json", "abide", "Sat, 10 Oct 2015 10:26:20 GMT")
         eq_(
@@ -105,6 +178,29 @@ class PDStorageClassMixin(object):
         self.storage.update("walter.json", json.dumps(data), "date")
         eq_(self.storage.data("walter.json"), data)
 
+    def test_json_loads_setting(self):
+        self.storage.update("the_dude.json", '{"dude": "abides"}', "a")
+        with override_settings(
+            PROD_DETAILS_JSON_LOADS="tests.test_storage.fake_json_loads"
+        ), patch.object(self.storage, "_snapshot", False, create=True):
+            eq_(
+                self.storage.dir_data("versions")["the_dude.json"],
+                {"parsed": '{"dude": "abides"}'},
+            )
+
+    def test_json_loads_imported_once(self):
+        utils.get_json_loads.cache_clear()
+        with patch(
+            "product_details.utils.import_string", return_value=json.loads
+        ) as import_mock:
+            eq_(utils.json_loads("[1]"), [1])
+            eq_(utils.json_loads("[2]"), [2])
+            eq_(import_mock.call_count, 1)
+            with override_settings(PROD_DETAILS_JSON_LOADS="json.loads"):
+                utils.json_loads("[3]")
+            eq_(import_mock.call_count, 2)
+        utils.get_json_loads.cache_clear()
+
     def test_json_parsing_error(self):
         self.storage.update("donnie.json", "not json", "date")
         ok_(self.storage.data("donnie.json") is None)
@@ -153,6 +249,18 @@ class PDFileStorageTests(PDStorageClassMixin, TestCase):
             ]
         )
 
+    def test_update_invalidates_cache(self):
+        self.storage.update("walter.json", '{"walter": "bowls"}', "a")
+        eq_(self.storage.data("walter.json"), {"walter": "bowls"})
+        self.storage.update("walter.json", '{"walter": "shouts"}', "a")
+        eq_(self.storage.data("walter.json"), {"walter": "shouts"})
+
+    def test_unchanged_file_not_written(self):
+        self.storage.update("walter.json", '{"walter": "bowls"}', "a")
+        with patch("product_details.storage.shutil.move") as move_mock:
+            self.storage.update("walter.json", '{"walter": "bowls"}', "b")
+            ok_(not move_mock.called)
+
     def test_all_json_files(self):
         sto = storage.PDFileStorage(json_dir="/path/to/json/files")
         walk_results = [
@@ -169,11 +277,11 @@ class PDFileStorageTests(PDStorageClassMixin, TestCase):
         sto = storage.PDFileStorage(json_dir="/does/not/exist")
         eq_(sto.all_json_files(), [])
 
-    @patch("json.loads")
+    @patch("product_details.storage.json_loads")
     def test_no_cache_corrupt_files(self, load_mock):
         """The fact that a file doesn't parse correctly should not be cached."""
         load_mock.side_effect = ValueError
-        with patch.object(
+        with patch.object(self.storage, "_snapshot", False), patch.object(
             self.storage, "all_json_files", return_value=["the_dude.json"]
         ):
             with patch.object(self.storage, "content", return_value="dude"):
@@ -182,7 +290,7 @@ class PDFileStorageTests(PDStorageClassMixin, TestCase):
                 eq_(load_mock.call_count, 2)
 
     def test_load_correct_files_per_folder(self):
-        with patch.object(
+        with patch.object(self.storage, "_snapshot", False), patch.object(
             self.storage,
             "all_json_files",
             return_value=[
@@ -202,6 +310,124 @@ class PDFileStorageTests(PDStorageClassMixin, TestCase):
                 self.assertEqual(len(versions_data), 2)
                 self.assertEqual(len(regions_data), 2)
 
+    def test_snapshot(self):
+        sto = storage.PDFileStorage(json_dir=mkdtemp())
+        sto.update("walter.json", '{"walter": "bowls"}', "a")
+        sto.update("regions/de.json", '{"de": "Germany"}', "a")
+        ok_(os.path.exists(sto.snapshot_file_name("versions")))
+        with patch.object(sto, "content") as content_mock:
+            eq_(sto.dir_data("versions"), {"walter.json": {"walter": "bowls"}})
+            eq_(sto.dir_data("regions"), {"regions/de.json": {"de": "Germany"}})
+            ok_(not content_mock.called)
+
+    def test_snapshot_out_of_date(self):
+        sto = storage.PDFileStorage(json_dir=mkdtemp())
+        sto.update("walter.json", '{"walter": "bowls"}', "a")
+        # as if written by a process without snapshots
+        other = storage.PDFileStorage(json_dir=sto.json_dir, snapshot=False)
+        other.update("dude.json", '{"dude": "abides"}', "a")
+        ok_(sto.read_snapshot("versions") is None)
+        eq_(
+            sto.dir_data("versions"),
+            {"walter.json": {"walter": "bowls"}, "dude.json": {"dude": "abides"}},
+        )
+
+    def test_snapshot_corrupt(self):
+        sto = storage.PDFileStorage(json_dir=mkdtemp())
+        sto.update("walter.json", '{"walter": "bowls"}', "a")
+        with open(sto.snapshot_file_name("versions"), "wb") as snapshot_fo:
+            snapshot_fo.write(b"dude")
+        eq_(sto.dir_data("versions"), {"walter.json": {"walter": "bowls"}})
+
+    def test_snapshot_mode(self):
+        sto = storage.PDFileStorage(json_dir=mkdtemp())
+        sto.update("walter.json", '{"walter": "bowls"}', "a")
+        eq_(os.stat(sto.snapshot_file_name("versions")).st_mode & 0o777, 0o644)
+
+    def test_snapshot_write_error(self):
+        sto = storage.PDFileStorage(json_dir=mkdtemp())
+        with patch("product_details.storage.marshal.dump", side_effect=ValueError):
+            sto.update("walter.json", '{"walter": "bowls"}', "a")
+        ok_(not os.path.exists(sto.snapshot_file_name("versions")))
+        eq_(
+            sorted(fn for fn in os.listdir(sto.json_dir) if not fn.startswith(".")),
+            ["walter.json"],
+        )
+
+    def test_snapshot_stamp_checked_first(self):
+        """An out of date snapshot should not be loaded."""
+        sto = storage.PDFileStorage(json_dir=mkdtemp())
+        sto.update("walter.json", '{"walter": "bowls"}', "a")
+        other = storage.PDFileStorage(json_dir=sto.json_dir, snapshot=False)
+        other.update("dude.json", '{"dude": "abides"}', "a")
+        with patch("product_details.storage.marshal.load") as load_mock:
+            load_mock.return_value = []
+            ok_(sto.read_snapshot("versions") is None)
+            eq_(load_mock.call_count, 1)
+
+    @patch("product_details.storage.json_loads", wraps=json.loads)
+    def test_update_fills_cache(self, loads_mock):
+        """Updated data should be cached without parsing it again."""
+        sto = storage.PDFileStorage(json_dir=mkdtemp(), snapshot=False)
+        sto.clear_cache()
+        sto.update("walter.json", '{"walter": "bowls"}', "a")
+        eq_(loads_mock.call_count, 0)
+        sto.update_many([("dude.json", '{"dude": "abides"}', "a", None, {"dude": "abides"})])
+        # the unchanged file is parsed to fill the cache
+        eq_(loads_mock.call_count, 1)
+        eq_(sto.data("dude.json"), {"dude": "abides"})
+        eq_(sto.data("walter.json"), {"walter": "bowls"})
+        eq_(loads_mock.call_count, 1)
+
+    @patch("product_details.storage.json_loads", wraps=json.loads)
+    def test_update_file_by_file(self, loads_mock):
+        """Updating single files should not load their directory."""
+        sto = storage.PDFileStorage(json_dir=mkdtemp(), snapshot=False)
+        sto.clear_cache()
+        for i in range(5):
+            sto.update("%s.json" % i, "[%s]" % i, "a", data=[i])
+        eq_(loads_mock.call_count, 0)
+        eq_(sto.data("4.json"), [4])
+
+    def test_update_file_per_file_cache(self):
+        sto = storage.PDFileStorage(json_dir=mkdtemp(), cache_per_file=True)
+        sto.clear_cache()
+        sto.update("walter.json", '{"walter": "bowls"}', "a")
+        sto.update("dude.json", '{"dude": "abides"}', "a")
+        eq_(sto.data("dude.json"), {"dude": "abides"})
+        with patch.object(sto, "dir_data") as dir_data_mock:
+            sto.update("dude.json", '{"dude": "bowls"}', "b", data={"dude": "bowls"})
+            sto.update("donnie.json", "[1]", "b", data=[1])
+            eq_(sto.data("dude.json"), {"dude": "bowls"})
+            eq_(sto.data("walter.json"), {"walter": "bowls"})
+            eq_(sto.data("donnie.json"), [1])
+            ok_(not dir_data_mock.called)
+
+    @patch("product_details.storage.json_loads", wraps=json.loads)
+    def test_snapshot_parsed_data(self, loads_mock):
+        """Only files whose data is not known should be parsed for a snapshot."""
+        sto = storage.PDFileStorage(json_dir=mkdtemp())
+        sto.update_many(
+            [
+                ("walter.json", '{"walter": "bowls"}', "a", None, {"walter": "bowls"}),
+                ("dude.json", '{"dude": "abides"}', "a", None, {"dude": "abides"}),
+            ]
+        )
+        eq_(loads_mock.call_count, 0)
+        sto.update("donnie.json", '["out of his element"]', "b")
+        eq_(loads_mock.call_count, 1)
+        sto.update("walter.json", '{"walter": "shomer shabbos"}', "c", data={"a": 1})
+        eq_(loads_mock.call_count, 1)
+        eq_(
+            sto.dir_data("versions"),
+            {
+                "walter.json": {"a": 1},
+                "dude.json": {"dude": "abides"},
+                "donnie.json": ["out of his element"],
+            },
+        )
+        eq_(loads_mock.call_count, 1)
+
 
 class PDDatabaseStorageTests(PDStorageClassMixin, TestCase):
     storage = storage.PDDatabaseStorage()
@@ -211,7 +437,7 @@ class PDDatabaseStorageTests(PDStorageClassMixin, TestCase):
         ProductDetailsFile.objects.all().delete()
         super(PDDatabaseStorageTests, self).setUp()
 
-    @patch("json.loads")
+    @patch("product_details.storage.json_loads")
     def test_no_cache_corrupt_files(self, load_mock):
         """The fact that a file doesn't parse correctly should not be cached."""
         load_mock.side_effect = ValueError
@@ -238,6 +464,490 @@ class PDDatabaseStorageTests(PDStorageClassMixin, TestCase):
         self.assertEqual(len(versions_data), 2)
         self.assertEqual(len(regions_data), 2)
 
+    def test_last_modified_many(self):
+        ProductDetailsFile.objects.create(name="the_dude.json", last_modified="a")
+        ProductDetailsFile.objects.create(name="walter.json", last_modified="b")
+        with self.assertNumQueries(1):
+            eq_(
+                self.storage.last_modified_many(["the_dude.json", "donnie.json"]),
+                {"the_dude.json": "a"},
+            )
+
+    def test_request_headers(self):
+        ProductDetailsFile.objects.create(
+            name="the_dude.json", last_modified="a", etag='"x"'
+        )
+        with self.assertNumQueries(1):
+            eq_(
+                sync.request_headers(self.storage, ["the_dude.json", "walter.json"]),
+                [{"If-Modified-Since": "a", "If-None-Match": '"x"'}, {}],
+            )
+        with self.assertNumQueries(0):
+            eq_(sync.request_headers(self.storage, []), [])
+
+    def test_update_many(self):
+        ProductDetailsFile.objects.create(name="the_dude.json", content="[]")
+        with self.assertNumQueries(3):
+            self.storage.update_many(
+                [
+                    ("the_dude.json", '["abides"]', "a", None),
+                    ("walter.json", '["bowls"]', "b", None),
+                    ("donnie.json", '["out of his element"]', "c", None),
+                ]
+            )
+        eq_(self.storage.content("the_dude.json"), '["abides"]')
+        eq_(self.storage.last_modified("the_dude.json"), "a")
+        eq_(self.storage.content("walter.json"), '["bowls"]')
+        eq_(self.storage.last_modified("donnie.json"), "c")
+
+    @patch("product_details.storage.json_loads", wraps=json.loads)
+    def test_update_many_fills_cache(self, loads_mock):
+        """Updated data should be cached once committed, without parsing it."""
+        ProductDetailsFile.objects.create(name="walter.json", content='["bowls"]')
+        self.storage.clear_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.update_many(
+                [("the_dude.json", '["abides"]', "a", None, ["abides"])]
+            )
+            eq_(loads_mock.call_count, 0)
+        eq_(loads_mock.call_count, 1)
+        eq_(self.storage.data("the_dude.json"), ["abides"])
+        eq_(self.storage.data("walter.json"), ["bowls"])
+        eq_(loads_mock.call_count, 1)
+
+    @patch("product_details.storage.json_loads", wraps=json.loads)
+    def test_update_file_by_file(self, loads_mock):
+        """Updating single files should not load their directory."""
+        self.storage.clear_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(20):
+                self.storage.update("%s.json" % i, "[%s]" % i, "a", data=[i])
+        eq_(loads_mock.call_count, 0)
+
+    def test_update_many_parsed_data(self):
+        eq_(
+            self.storage.update_many([("the_dude.json", "[1]", "a", None, [1])]),
+            ["the_dude.json"],
+        )
+        eq_(self.storage.content("the_dude.json"), "[1]")
+
+
+class LocalCacheTests(TestCase):
+    def setUp(self):
+        self.storage = storage.PDFileStorage(json_dir=mkdtemp(), local_cache_timeout=60)
+        self.storage.clear_cache()
+        self.storage.update("dude.json", '{"dude": "abides"}', "date")
+
+    def test_local_cache_hit(self):
+        """Within the timeout the shared cache should not be asked again."""
+        eq_(self.storage.data("dude.json"), {"dude": "abides"})
+        with patch.object(self.storage, "_cache") as cache_mock:
+            eq_(self.storage.data("dude.json"), {"dude": "abides"})
+            ok_(not cache_mock.method_calls)
+
+    @patch("product_details.storage.time.time")
+    def test_local_cache_generation_check(self, time_mock):
+        """After the timeout only the generation should be fetched."""
+        time_mock.return_value = 1000
+        eq_(self.storage.data("dude.json"), {"dude": "abides"})
+        time_mock.return_value = 1100
+        with patch.object(self.storage, "dir_data") as dir_data_mock:
+            with patch.object(
+                self.storage._cache, "get_many", wraps=self.storage._cache.get_many
+            ) as get_many_mock:
+                eq_(self.storage.data("dude.json"), {"dude": "abides"})
+                get_many_mock.assert_called_once_with(
+                    ["prod-details:versions:generation"]
+                )
+            ok_(not dir_data_mock.called)
+
+    @patch("product_details.storage.time.time")
+    def test_local_cache_invalidated(self, time_mock):
+        time_mock.return_value = 1000
+        eq_(self.storage.data("dude.json"), {"dude": "abides"})
+        # as if updated by another process
+        other = storage.PDFileStorage(json_dir=self.storage.json_dir)
+        other.update("dude.json", '{"dude": "bowls"}', "date")
+        # still served from the local cache within the timeout
+        eq_(self.storage.data("dude.json"), {"dude": "abides"})
+        time_mock.return_value = 1100
+        eq_(self.storage.data("dude.json"), {"dude": "bowls"})
+
+    def test_local_cache_size(self):
+        sto = storage.PDFileStorage(
+            json_dir=self.storage.json_dir, local_cache_timeout=60, local_cache_size=1
+        )
+        sto.update("regions/de.json", '{"de": "Germany"}', "date")
+        sto.data("dude.json")
+        sto.data("regions/de.json")
+        eq_(len(sto._local_cache), 1)
+        ok_(sto._local_cache.get("prod-details:regions"))
+
+
+class PerFileCacheTests(TestCase):
+    def setUp(self):
+        self.storage = storage.PDFileStorage(json_dir=mkdtemp(), cache_per_file=True)
+        self.storage.clear_cache()
+        self.storage.update("regions/de.json", '{"de": "Germany"}', "date")
+        self.storage.update("regions/fr.json", '{"fr": "France"}', "date")
+
+    def test_cache_per_file(self):
+        with patch.object(
+            self.storage, "dir_data", wraps=self.storage.dir_data
+        ) as dir_data_mock:
+            eq_(self.storage.data("regions/de.json"), {"de": "Germany"})
+            eq_(self.storage.data("regions/fr.json"), {"fr": "France"})
+            ok_(self.storage.data("regions/xx.json") is None)
+            dir_data_mock.assert_called_once_with("regions")
+
+        cache = self.storage._cache
+        eq_(cache.get("prod-details:regions/de.json"), {"de": "Germany"})
+        eq_(
+            cache.get("prod-details:regions:files"),
+            ["regions/de.json", "regions/fr.json"],
+        )
+        ok_(cache.get("prod-details:regions") is None)
+
+    def test_evicted_file_reloads(self):
+        self.storage.data("regions/de.json")
+        self.storage._cache.delete("prod-details:regions/fr.json")
+        eq_(self.storage.data("regions/fr.json"), {"fr": "France"})
+
+    def test_data_many(self):
+        self.storage.data("regions/de.json")
+        with patch.object(self.storage, "dir_data") as dir_data_mock:
+            eq_(
+                self.storage.data_many(["regions/de.json", "regions/fr.json"]),
+                {"regions/de.json": {"de": "Germany"}, "regions/fr.json": {"fr": "France"}},
+            )
+            eq_(
+                self.storage.file_names("regions"),
+                ["regions/de.json", "regions/fr.json"],
+            )
+            ok_(not dir_data_mock.called)
+
+    def test_delete_cache_without_index(self):
+        """File entries should be deleted even if the index was evicted."""
+        self.storage.data("regions/de.json")
+        self.storage._write("regions/de.json", '{"de": "Deutschland"}', "date")
+        self.storage._cache.delete("prod-details:regions:files")
+        self.storage.delete_cache("regions")
+        ok_(self.storage._cache.get("prod-details:regions/de.json") is None)
+        eq_(self.storage.data("regions/de.json"), {"de": "Deutschland"})
+
+    def test_delete_cache(self):
+        self.storage.data("regions/de.json")
+        self.storage.update("regions/de.json", '{"de": "Deutschland"}', "date")
+        self.storage.delete_cache("regions")
+        ok_(self.storage._cache.get("prod-details:regions/fr.json") is None)
+        eq_(self.storage.data("regions/de.json"), {"de": "Deutschland"})
+
+
+class LazyLoadTests(TestCase):
+    def setUp(self):
+        self.storage = storage.PDFileStorage(json_dir=mkdtemp(), lazy_load=True)
+        self.storage.clear_cache()
+        self.storage.update("regions/de.json", '{"de": "Germany"}', "date")
+        self.storage.update("regions/fr.json", '{"fr": "France"}', "date")
+
+    def test_load_one_file(self):
+        with patch.object(
+            self.storage, "content", wraps=self.storage.content
+        ) as content_mock:
+            eq_(self.storage.data("regions/de.json"), {"de": "Germany"})
+            eq_(self.storage.data("regions/de.json"), {"de": "Germany"})
+            ok_(self.storage.data("regions/xx.json") is None)
+            content_mock.assert_called_once_with("regions/de.json")
+
+        cache = self.storage._cache
+        ok_(cache.get("prod-details:regions/fr.json") is None)
+        eq_(
+            cache.get("prod-details:regions:files"),
+            ["regions/de.json", "regions/fr.json"],
+        )
+
+    def test_delete_cache(self):
+        self.storage.data("regions/de.json")
+        self.storage._cache.delete("prod-details:regions:files")
+        self.storage.delete_cache("regions")
+        ok_(self.storage._cache.get("prod-details:regions/de.json") is None)
+
+    def test_update(self):
+        self.storage.data("regions/de.json")
+        self.storage.update("regions/de.json", '{"de": "Deutschland"}', "date")
+        self.storage.update("regions/es.json", '{"es": "Spain"}', "date")
+        eq_(self.storage.data("regions/de.json"), {"de": "Deutschland"})
+        eq_(self.storage.data("regions/es.json"), {"es": "Spain"})
+
+    def test_single_flight(self):
+        """Threads should load a file only once at a time."""
+        file_data = self.storage.file_data
+        started = threading.Event()
+
+        def slow_file_data(name):
+            started.set()
+            time.sleep(0.1)
+            return file_data(name)
+
+        self.storage.file_names("regions")
+        results = []
+        with patch.object(
+            self.storage, "file_data", side_effect=slow_file_data
+        ) as file_data_mock:
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(self.storage.data("regions/de.json"))
+                )
+                for _ in range(5)
+            ]
+            threads[0].start()
+            started.wait()
+            for thread in threads[1:]:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            file_data_mock.assert_called_once_with("regions/de.json")
+
+        eq_(results, [{"de": "Germany"}] * 5)
+
+    def test_local_cache(self):
+        sto = storage.PDFileStorage(
+            json_dir=self.storage.json_dir, lazy_load=True, local_cache_timeout=60
+        )
+        eq_(sto.data("regions/de.json"), {"de": "Germany"})
+        with patch.object(sto._cache, "get_many") as get_many_mock:
+            eq_(sto.data("regions/de.json"), {"de": "Germany"})
+            ok_(not get_many_mock.called)
+
+        # loading another file keeps the generation of the directory
+        generation = sto._cache.get("prod-details:regions:generation")
+        eq_(sto.data("regions/fr.json"), {"fr": "France"})
+        eq_(sto._cache.get("prod-details:regions:generation"), generation)
+
+    def test_db_storage(self):
+        sto = storage.PDDatabaseStorage(lazy_load=True)
+        sto.clear_cache()
+        sto.update("regions/de.json", '{"de": "Germany"}', "date")
+        sto.update("regions/fr.json", '{"fr": "France"}', "date")
+        with patch.object(sto, "dir_data") as dir_data_mock:
+            eq_(sto.data("regions/de.json"), {"de": "Germany"})
+            ok_(sto.data("regions/xx.json") is None)
+            ok_(not dir_data_mock.called)
+
+
+class ReloadTests(TestCase):
+    def setUp(self):
+        self.storage = storage.PDFileStorage(json_dir=mkdtemp(), reload_interval=60)
+        self.storage.clear_cache()
+        self.storage.update("dude.json", '{"dude": "abides"}', "date")
+        self.storage.update("/", "", "date")
+
+    def update_elsewhere(self, content):
+        # as if updated by a process with another cache
+        other = storage.PDFileStorage(json_dir=self.storage.json_dir, snapshot=False)
+        other._write("dude.json", content, "date")
+        other._write("/", "", "date 2")
+        stamp = os.stat(other.last_modified_file_name("/")).st_mtime_ns + 10 ** 9
+        os.utime(other.last_modified_file_name("/"), ns=(stamp, stamp))
+
+    @patch("product_details.storage.time.monotonic")
+    def test_reload(self, monotonic_mock):
+        monotonic_mock.return_value = 1000
+        eq_(self.storage.data("dude.json"), {"dude": "abides"})
+        self.update_elsewhere('{"dude": "bowls"}')
+        # not checked again before the interval
+        monotonic_mock.return_value = 1030
+        eq_(self.storage.data("dude.json"), {"dude": "abides"})
+        monotonic_mock.return_value = 1061
+        eq_(self.storage.data("dude.json"), {"dude": "bowls"})
+
+    @patch("product_details.storage.time.monotonic")
+    def test_cleared_once(self, monotonic_mock):
+        monotonic_mock.return_value = 1000
+        self.storage.data("dude.json")
+        self.update_elsewhere('{"dude": "bowls"}')
+        monotonic_mock.return_value = 1100
+        other = storage.PDFileStorage(json_dir=self.storage.json_dir, reload_interval=60)
+        eq_(other.data("dude.json"), {"dude": "bowls"})
+        with patch.object(self.storage, "delete_cache") as delete_cache_mock:
+            eq_(self.storage.data("dude.json"), {"dude": "bowls"})
+            ok_(not delete_cache_mock.called)
+
+    @patch("product_details.storage.time.monotonic")
+    def test_reload_stamp_evicted(self, monotonic_mock):
+        """A missing stamp should not be taken for an up to date cache."""
+        monotonic_mock.return_value = 1000
+        eq_(self.storage.data("dude.json"), {"dude": "abides"})
+        self.storage._cache.delete("prod-details:last_update")
+        self.update_elsewhere('{"dude": "bowls"}')
+        monotonic_mock.return_value = 1100
+        other = storage.PDFileStorage(json_dir=self.storage.json_dir, reload_interval=60)
+        eq_(other.data("dude.json"), {"dude": "bowls"})
+        eq_(self.storage.data("dude.json"), {"dude": "bowls"})
+
+    def test_no_reload_after_own_update(self):
+        self.storage.data("dude.json")
+        self.storage.update("dude.json", '{"dude": "bowls"}', "date 2")
+        self.storage.update("/", "", "date 2")
+        self.storage._next_update_check = 0
+        with patch.object(self.storage, "delete_cache") as delete_cache_mock:
+            eq_(self.storage.data("dude.json"), {"dude": "bowls"})
+            ok_(not delete_cache_mock.called)
+
+
+class SignalsTests(TestCase):
+    def setUp(self):
+        self.storage = storage.PDFileStorage(json_dir=mkdtemp())
+        self.storage.clear_cache()
+        self.storage.update("dude.json", '{"dude": "abides"}', "date")
+        self.storage.update("regions/de.json", '{"de": "Germany"}', "date")
+        self.received = []
+
+    def receiver(self, signal, sender, **kwargs):
+        kwargs.pop("storage", None)
+        self.received.append((signal, kwargs))
+
+    def connect(self, signal):
+        signal.connect(self.receiver, weak=False)
+        self.addCleanup(signal.disconnect, self.receiver)
+
+    def test_cache_signals(self):
+        for signal in (signals.cache_hit, signals.cache_miss, signals.data_loaded):
+            self.connect(signal)
+
+        self.storage.data("dude.json")
+        self.storage.data("dude.json")
+        eq_(self.received[0], (signals.cache_miss, {"key": "prod-details:versions"}))
+        signal, kwargs = self.received[1]
+        eq_(signal, signals.data_loaded)
+        eq_((kwargs["name"], kwargs["files"]), ("versions", 1))
+        ok_(kwargs["duration"] >= 0)
+        eq_(self.received[2], (signals.cache_hit, {"key": "prod-details:versions"}))
+        eq_(len(self.received), 3)
+
+    def test_regions_lookup(self):
+        self.connect(signals.regions_lookup)
+        pd = product_details.ProductDetails()
+        pd._real_storage = self.storage
+        pd.get_regions("de-AT")
+        with self.assertRaises(product_details.MissingJSONData):
+            pd.get_regions("fr")
+        eq_(
+            self.received,
+            [
+                (signals.regions_lookup, {"locale": "de-AT", "depth": 1}),
+                (signals.regions_lookup, {"locale": "fr", "depth": None}),
+            ],
+        )
+
+
+class RegionsTests(TestCase):
+    def setUp(self):
+        self.pd = product_details.ProductDetails()
+        self.pd._real_storage = storage.PDFileStorage(json_dir=mkdtemp())
+        self.pd._storage.clear_cache()
+        self.pd._storage.update("regions/de.json", '{"de": "Germany"}', "date")
+        self.pd._storage.update("regions/en-US.json", '{"us": "USA"}', "date")
+
+    def test_single_fetch(self):
+        """The regions directory should be fetched once per lookup."""
+        self.pd.get_regions("de")
+        with patch.object(
+            self.pd._storage._cache, "get_many", wraps=self.pd._storage._cache.get_many
+        ) as get_many_mock:
+            eq_(self.pd.get_regions("de-AT"), {"de": "Germany"})
+            eq_(self.pd.get_regions("xx"), {"us": "USA"})
+            eq_(get_many_mock.call_count, 2)
+
+    def test_empty_file_falls_back(self):
+        """Files without data should be skipped, in every cache mode."""
+        json_dir = self.pd._storage.json_dir
+        with open(os.path.join(json_dir, "regions", "es.json"), "w") as json_fo:
+            json_fo.write("not json")
+        for kwargs in ({}, {"cache_per_file": True}, {"lazy_load": True}):
+            self.pd._real_storage = storage.PDFileStorage(json_dir=json_dir, **kwargs)
+            self.pd._storage.clear_cache()
+            eq_(self.pd.get_regions("es-MX"), {"us": "USA"})
+            eq_(
+                self.pd.get_regions_many(["es", "de"]),
+                {"es": {"us": "USA"}, "de": {"de": "Germany"}},
+            )
+
+
+class CacheStampedeTests(TestCase):
+    def setUp(self):
+        self.storage = storage.PDFileStorage(json_dir=mkdtemp(), lock_timeout=5)
+        self.storage.clear_cache()
+        self.storage.update("dude.json", '{"dude": "abides"}', "date")
+
+    def test_single_flight_threads(self):
+        """Threads of a process should load a directory only once at a time."""
+        dir_data = self.storage.dir_data
+        started = threading.Event()
+
+        def slow_dir_data(name):
+            started.set()
+            time.sleep(0.1)
+            return dir_data(name)
+
+        results = []
+        with patch.object(
+            self.storage, "dir_data", side_effect=slow_dir_data
+        ) as dir_data_mock:
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(self.storage.data("dude.json"))
+                )
+                for _ in range(5)
+            ]
+            threads[0].start()
+            started.wait()
+            for thread in threads[1:]:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            dir_data_mock.assert_called_once_with("versions")
+
+        eq_(results, [{"dude": "abides"}] * 5)
+
+    def test_lock_released(self):
+        self.storage.data("dude.json")
+        ok_(self.storage._cache.get("prod-details:versions:lock") is None)
+
+    @patch("product_details.storage.time.sleep")
+    def test_wait_for_other_process(self, sleep_mock):
+        """Without stale data wait for the process holding the lock."""
+        self.storage._cache.add("prod-details:versions:lock", 1)
+        sleep_mock.side_effect = lambda s: self.storage.warm_cache("versions")
+        with patch.object(
+            self.storage, "dir_data", wraps=self.storage.dir_data
+        ) as dir_data_mock:
+            eq_(self.storage.data("dude.json"), {"dude": "abides"})
+            # called by the other "process" only
+            dir_data_mock.assert_called_once_with("versions")
+
+    @patch("product_details.storage.time.time")
+    def test_stale_data_served(self, time_mock):
+        sto = storage.PDFileStorage(
+            json_dir=self.storage.json_dir, local_cache_timeout=60, lock_timeout=5
+        )
+        time_mock.return_value = 1000
+        eq_(sto.data("dude.json"), {"dude": "abides"})
+        sto._cache.delete_many(
+            ["prod-details:versions", "prod-details:versions:generation"]
+        )
+        sto._cache.add("prod-details:versions:lock", 1)
+        time_mock.return_value = 1100
+        with patch.object(sto, "dir_data") as dir_data_mock:
+            eq_(sto.data("dude.json"), {"dude": "abides"})
+            ok_(not dir_data_mock.called)
+
+        sto._cache.delete("prod-details:versions:lock")
+        sto.update("dude.json", '{"dude": "bowls"}', "date")
+        eq_(sto.data("dude.json"), {"dude": "bowls"})
+
 
 @patch("product_details.product_details._real_storage", Mock())
 class ProductDetailsTests(TestCase):
@@ -257,6 +967,7 @@ class ProductDetailsTests(TestCase):
         """Make sure it's asking for the right files."""
         good_data = {"dude": "abide"}
         self.pd._storage.data.return_value = good_data
+        self.pd._storage.file_names.return_value = ["regions/de.json"]
         eq_(self.pd.get_regions("de"), good_data)
         self.pd._storage.data.assert_called_with("regions/de.json")
         self.pd._storage.reset_mock()
@@ -269,10 +980,86 @@ class ProductDetailsTests(TestCase):
 
     def test_no_file_response(self):
         self.pd._storage.data.return_value = None
+        self.pd._storage.file_names.return_value = []
         ok_(isinstance(self.pd.the_dude, defaultdict))
         with self.assertRaises(product_details.MissingJSONData):
             self.pd.get_regions("de")
 
+    def test_region_fallback(self):
+        pd = product_details.ProductDetails()
+        pd._real_storage = Mock()
+        pd._storage.file_names.return_value = ["regions/de.json", "regions/en-US.json"]
+        pd._storage.data.side_effect = lambda name: {"name": name}
+        eq_(pd.get_regions("de-AT"), {"name": "regions/de.json"})
+        eq_(pd.get_regions("xx-YY"), {"name": "regions/en-US.json"})
+        pd._storage.data.assert_has_calls(
+            [call("regions/de.json"), call("regions/en-US.json")]
+        )
+        with patch.object(pd, "_region_files") as region_files_mock:
+            pd.get_regions("xx-YY")
+            ok_(not region_files_mock.called)
+
+        pd._storage.file_names.return_value = ["regions/fr.json"]
+        with self.assertRaises(product_details.MissingJSONData):
+            pd.get_regions("xx-YY")
+
+    def test_custom_storage_regions(self):
+        """Storages need not say whether they cache per file."""
+        pd = product_details.ProductDetails()
+        pd._real_storage = Mock(spec=["data", "data_many"])
+        pd._storage.data_many.side_effect = lambda names: {
+            "regions/en-US.json": {"us": "USA"}
+        }
+        eq_(pd.get_regions("de-AT"), {"us": "USA"})
+        ok_(storage.PDFileStorage(cache_per_file=True).caches_per_file)
+        ok_(not storage.PDFileStorage(cache_per_file=False).caches_per_file)
+
+    def test_get_regions_many(self):
+        pd = product_details.ProductDetails()
+        pd._real_storage = Mock()
+        pd._storage.file_names.return_value = ["regions/de.json", "regions/en-US.json"]
+        pd._storage.data_many.side_effect = lambda names: dict(
+            (name, {"name": name}) for name in names
+        )
+        eq_(
+            pd.get_regions_many(["de", "de-AT", "xx"]),
+            {
+                "de": {"name": "regions/de.json"},
+                "de-AT": {"name": "regions/de.json"},
+                "xx": {"name": "regions/en-US.json"},
+            },
+        )
+        pd._storage.data_many.assert_called_once_with(
+            {"regions/de.json", "regions/en-US.json"}
+        )
+
+    def test_preload(self):
+        pd = product_details.ProductDetails()
+        pd._real_storage = Mock()
+        pd._storage.dir_data.side_effect = [
+            {"the_dude.json": {"dude": "abides"}},
+            {"regions/de.json": {"de": "Germany"}},
+        ]
+        pd.preload()
+        eq_(pd.the_dude, {"dude": "abides"})
+        eq_(pd.get_regions("de-AT"), {"de": "Germany"})
+        ok_(isinstance(pd.walter, defaultdict))
+        ok_(not pd._storage.data.called)
+        pd._storage.dir_data.assert_has_calls([call("versions"), call("regions")])
+
+    def test_preload_refresh(self):
+        pd = product_details.ProductDetails()
+        pd._real_storage = Mock()
+        pd._storage.dir_data.side_effect = [
+            {"the_dude.json": {"dude": "abides"}},
+            {},
+            {"the_dude.json": {"dude": "bowls"}},
+            {},
+        ]
+        pd.preload()
+        pd.preload()
+        eq_(pd.the_dude, {"dude": "bowls"})
+
 
 class LoadJSONFileDataTests(TestCase):
     def test_db_has_data(self):
@@ -0,0 +1,227 @@
+import asyncio
+import io
+import os
+import tarfile
+import zipfile
+from tempfile import mkdtemp
+from unittest import skipIf
+
+from django.test.testcases import TestCase
+
+from mock import patch
+from nose.tools import eq_, ok_
+
+from product_details import sync
+from product_details.storage import PDFileStorage
+from tests.server import StandInServer
+
+FILES = {
+    "firefox_versions.json": '{"LATEST_FIREFOX_VERSION": "100.0"}',
+    "languages.json": '{"de": {"English": "German"}}',
+    "regions/de.json": '{"de": "Deutschland"}',
+    "regions/fr.json": '{"fr": "Allemagne"}',
+}
+
+
+@skipIf(sync.httpx is None, "httpx is not installed")
+class AsyncUpdateTests(TestCase):
+    def setUp(self):
+        self.storage = PDFileStorage(json_dir=mkdtemp())
+
+    def update(self, files, **kwargs):
+        with StandInServer(files) as server:
+            result = asyncio.run(sync.async_update(self.storage, server.url, **kwargs))
+        return result, server
+
+    def test_update(self):
+        result, server = self.update(FILES, concurrency=2)
+        ok_(result)
+        for name, content in FILES.items():
+            eq_(self.storage.content(name), content)
+            eq_(self.storage.last_modified(name), server.last_modified)
+        eq_(self.storage.last_modified("/"), server.last_modified)
+        eq_(self.storage.last_modified("regions/"), server.last_modified)
+        eq_(self.storage.data("regions/de.json"), {"de": "Deutschland"})
+
+    def test_default_storage(self):
+        with StandInServer(FILES) as server, self.settings(
+            PROD_DETAILS_DIR=self.storage.json_dir
+        ):
+            ok_(asyncio.run(sync.async_update(url=server.url)))
+        eq_(self.storage.content("regions/de.json"), FILES["regions/de.json"])
+
+    def test_not_modified(self):
+        """Unchanged directories should cost a single request."""
+        self.update(FILES)
+        result, server = self.update(FILES)
+        ok_(result)
+        eq_(server.requests, ["", "regions/"])
+
+    def test_files_not_modified(self):
+        self.update(FILES)
+        self.storage.update("/", "", "Fri, 31 Dec 1999 00:00:00 GMT")
+        with self.assertLogs("prod_details", "DEBUG") as logs:
+            result, server = self.update(FILES)
+        ok_(result)
+        eq_(len([msg for msg in logs.output if "was not modified" in msg]), 3)
+        eq_(self.storage.last_modified("/"), server.last_modified)
+
+    def test_force(self):
+        self.update(FILES)
+        with self.assertLogs("prod_details", "DEBUG") as logs:
+            result, server = self.update(FILES, force=True)
+        ok_(not [msg for msg in logs.output if "was not modified" in msg])
+        eq_(len(server.requests), 6)
+
+    def test_reject_bad_files(self):
+        files = dict(FILES)
+        files["empty.json"] = ""
+        files["regions/bad.json"] = "not json"
+        result, server = self.update(files)
+        ok_(not result)
+        ok_(self.storage.content("empty.json") is None)
+        ok_(self.storage.content("regions/bad.json") is None)
+        # the good files are stored, but not the directory timestamps
+        eq_(self.storage.content("regions/de.json"), FILES["regions/de.json"])
+        ok_(self.storage.last_modified("/") is None)
+        ok_(self.storage.last_modified("regions/") is None)
+
+    def test_max_size(self):
+        files = dict(FILES)
+        files["big.json"] = '{"a": "%s"}' % ("x" * 100)
+        result, server = self.update(files, max_size=100)
+        ok_(not result)
+        ok_(self.storage.content("big.json") is None)
+        eq_(self.storage.content("languages.json"), FILES["languages.json"])
+
+
+class SourceTests(TestCase):
+    def setUp(self):
+        self.storage = PDFileStorage(json_dir=mkdtemp())
+
+    def write_files(self, files):
+        path = mkdtemp()
+        os.mkdir(os.path.join(path, "regions"))
+        for name, content in files.items():
+            with open(os.path.join(path, name), "w") as fo:
+                fo.write(content)
+        return path
+
+    def check_files(self):
+        for name, content in FILES.items():
+            eq_(self.storage.content(name), content)
+        eq_(self.storage.data("regions/de.json"), {"de": "Deutschland"})
+
+    def test_directory(self):
+        ok_(sync.update_from_source(self.storage, sync.DirectorySource(self.write_files(FILES))))
+        self.check_files()
+        ok_(self.storage.last_modified("regions/").endswith(" GMT"))
+
+    def test_storage_directory(self):
+        """The files and dates of a PDFileStorage directory should be copied."""
+        other = PDFileStorage(json_dir=mkdtemp())
+        for name, content in FILES.items():
+            other.update(name, content, "Sat, 01 Jan 2000 00:00:00 GMT")
+        other.update("/", "", "Sun, 02 Jan 2000 00:00:00 GMT")
+        other.update("regions/", "", "Sun, 02 Jan 2000 00:00:00 GMT")
+
+        source = sync.get_source("file://" + other.json_dir)
+        ok_(sync.update_from_source(self.storage, source))
+        self.check_files()
+        eq_(self.storage.last_modified("languages.json"), "Sat, 01 Jan 2000 00:00:00 GMT")
+        eq_(self.storage.last_modified("/"), "Sun, 02 Jan 2000 00:00:00 GMT")
+
+        with patch.object(self.storage, "update_many") as update_many_mock:
+            ok_(sync.update_from_source(self.storage, source))
+            ok_(not update_many_mock.called)
+            ok_(sync.update_from_source(self.storage, source, force=True))
+            eq_(update_many_mock.call_count, 2)
+
+    def test_tar_archive(self):
+        filename = os.path.join(mkdtemp(), "product-details.tar.gz")
+        with tarfile.open(filename, "w:gz") as archive:
+            for name, content in FILES.items():
+                data = content.encode("utf8")
+                info = tarfile.TarInfo("json/" + name)
+                info.size = len(data)
+                info.mtime = 946684800
+                archive.addfile(info, io.BytesIO(data))
+
+        ok_(sync.update_from_source(self.storage, sync.get_source(filename)))
+        self.check_files()
+        eq_(self.storage.last_modified("/"), "Sat, 01 Jan 2000 00:00:00 GMT")
+
+    def test_zip_archive(self):
+        filename = os.path.join(mkdtemp(), "product-details.zip")
+        with zipfile.ZipFile(filename, "w") as archive:
+            for name, content in FILES.items():
+                archive.writestr(name, content)
+
+        source = sync.get_source(filename)
+        ok_(isinstance(source, sync.ArchiveSource))
+        ok_(sync.update_from_source(self.storage, source))
+        self.check_files()
+
+    def test_reject_bad_files(self):
+        files = dict(FILES)
+        files["regions/bad.json"] = "not json"
+        source = sync.DirectorySource(self.write_files(files))
+        ok_(not sync.update_from_source(self.storage, source))
+        eq_(self.storage.content("regions/de.json"), FILES["regions/de.json"])
+        ok_(self.storage.content("regions/bad.json") is None)
+        ok_(self.storage.last_modified("regions/") is None)
+
+    def test_parsed_once(self):
+        """Every file should only be parsed by the sync, not by the storage."""
+        source = sync.DirectorySource(self.write_files(FILES))
+        with patch("product_details.sync.json_loads") as sync_loads, patch(
+            "product_details.storage.json_loads"
+        ) as storage_loads:
+            sync_loads.side_effect = lambda text: {"parsed": text}
+            ok_(sync.update_from_source(self.storage, source))
+        eq_(sync_loads.call_count, len(FILES))
+        ok_(not storage_loads.called)
+        eq_(
+            self.storage.data("regions/de.json"),
+            {"parsed": FILES["regions/de.json"]},
+        )
+
+    def test_bad_source(self):
+        with self.assertRaises(ValueError):
+            sync.get_source("/does/not/exist")
+
+
+class CheckJSONTests(TestCase):
+    def test_check_json(self):
+        ok_(sync.check_json("dude.json", '{"dude": "abides"}'))
+        ok_(not sync.check_json("dude.json", ""))
+        ok_(not sync.check_json("dude.json", "{nope"))
+
+    def test_parse_json(self):
+        eq_(sync.parse_json("dude.json", '{"dude": "abides"}'), (True, {"dude": "abides"}))
+        eq_(sync.parse_json("dude.json", "{nope"), (False, None))
+
+    def test_read_body(self):
+        eq_(sync.read_body("test.json", [b'{"a": ', b'"\xc3\xa4"}'], 0), '{"a": "\xe4"}')
+        ok_(sync.read_body("test.json", [b'"\xe4"'], 0) is None)
+
+    def test_read_body_max_size(self):
+        """Reading should stop as soon as the body is too large."""
+
+        def chunks():
+            yield b"[1, 2, 3"
+            yield b", 4]"
+            raise AssertionError("read past the limit")
+
+        ok_(sync.read_body("test.json", chunks(), 10) is None)
+
+    def test_too_large(self):
+        ok_(sync.too_large("test.json", "11", 10))
+        ok_(not sync.too_large("test.json", 10, 10))
+        ok_(not sync.too_large("test.json", None, 10))
+        ok_(not sync.too_large("test.json", "bogus", 10))
+        ok_(not sync.too_large("test.json", 11, 0))
+
+    def test_parse_file_list(self):
+        html = '<a href="dude.json">dude</a> <a href="walter.txt">walter</a>'
+        eq_(sync.parse_file_list(html), {"dude.json"})
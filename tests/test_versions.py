@@ -1,15 +1,19 @@
 import copy
+import pickle
 
 from django.test import SimpleTestCase
 
-from nose.tools import eq_
+from nose.tools import eq_, ok_
 
 from product_details.version_compare import (
     Version,
+    sort_versions,
     version_dict,
     version_int,
+    version_ints,
     version_list,
 )
+from product_details.version_compare.decorators import memoize
 
 
 # Versions to test listed in ascending order, none can be equal.
@@ -81,6 +85,38 @@ class TestVersions(SimpleTestCase):
             for v2 in equal_vers:
                 eq_(v1, v2)
 
+    def test_version_hashable(self):
+        versions = set(Version(v) for v in EQUALITY)
+        eq_(len(versions), 1)
+        ok_(Version("1.1pre0") in versions)
+        ok_(Version("1.1") not in versions)
+
+    def test_version_other_types(self):
+        """Versions should not be equal to, nor ordered with, other types."""
+        d = {version_int("1.0"): 1, Version("1.0"): 2}
+        eq_(len(d), 2)
+        ok_(Version("1.0") != version_int("1.0"))
+        ok_(Version("1.0") != "1.0")
+        with self.assertRaises(TypeError):
+            Version("1.0") < 1
+        with self.assertRaises(TypeError):
+            Version("1.0") >= 1
+
+    def test_version_immutable(self):
+        v = Version("4.0b10")
+        with self.assertRaises(AttributeError):
+            v.major = 5
+        with self.assertRaises(AttributeError):
+            v.dude = "abides"
+        ok_(not hasattr(v, "__dict__"))
+        eq_((v.major, v.alpha, v.alpha_ver), (4, "b", 10))
+        eq_(pickle.loads(pickle.dumps(v)), v)
+        eq_(str(pickle.loads(pickle.dumps(v))), "4.0b10")
+
+    def test_version_interned(self):
+        ok_(Version.interned("4.0b10") is Version.interned("4.0b10"))
+        eq_(Version.interned("4.0b10"), Version("4.0b10"))
+
     def test_simplify_version(self):
         """Make sure version simplification works."""
         versions = {
@@ -143,3 +179,45 @@ class TestVersions(SimpleTestCase):
         eq_(len(expected), len(test_list))
         for n, v in enumerate(test_list):
             eq_(v, expected[n])
+
+    def test_version_list_filter(self):
+        my_versions = {"4.0b1": "2010-11-24", "4.0": "2011-03-22", "3.6": "2010-01-21"}
+        eq_(version_list(my_versions, filter=lambda v: v.is_release), ["4.0", "3.6"])
+
+    def test_version_ints(self):
+        versions = list(COMPARISONS) + ["", "dude", "4.0b8pre"]
+        eq_(version_ints(versions), [version_int(v) for v in versions])
+
+    def test_sort_versions(self):
+        shuffled = list(reversed(COMPARISONS[::2])) + list(COMPARISONS[1::2])
+        for reverse in (False, True):
+            expected = sorted((Version(v) for v in shuffled), reverse=reverse)
+            eq_(
+                sort_versions(iter(shuffled), reverse=reverse),
+                [str(v) for v in expected],
+            )
+
+
+class TestMemoize(SimpleTestCase):
+    def test_memoize(self):
+        calls = []
+
+        @memoize(maxsize=2)
+        def double(x):
+            calls.append(x)
+            return x * 2
+
+        eq_([double(1), double(1), double(2), double(3), double(1)], [2, 2, 4, 6, 2])
+        eq_(calls, [1, 2, 3, 1])
+        info = double.cache_info()
+        eq_((info.hits, info.misses, info.currsize), (1, 4, 2))
+        double.cache_clear()
+        eq_(double.cache_info().currsize, 0)
+
+    def test_unhashable_arguments(self):
+        @memoize
+        def length(x):
+            return len(x)
+
+        eq_(length([1, 2]), 2)
+        eq_(length.cache_info().currsize, 0)